@@ -0,0 +1,301 @@
+"""
+Local aggregation service: the heavy part of the app behind an HTTP API.
+
+An asyncio server owns a process pool of workers and a result cache. Each
+request is reduced and binned on a worker process, so long queries neither
+block a Streamlit session nor contend for its GIL, and the number of workers
+scales independently of the number of UI sessions. Identical concurrent
+requests share one computation.
+
+    python aggregation_service.py --port 8765 --workers 4
+    AGGREGATION_SERVICE_URL=http://127.0.0.1:8765 streamlit run main.py
+
+Endpoints:
+    GET /aggregate?data_type=Daily&variable=C&start=2022-01-01&stop=2022-02-01
+        &resolution=4&aggr=sum[&bbox=min_lat,min_lon,max_lat,max_lon]
+        Hexagons of the window [start, stop) as an Arrow IPC stream with
+        columns hex_id (uint64) and value (float32).
+    GET /stats
+        Cache and worker counters as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from dataset_pool import get_pool
+from hex_binning import AGGREGATIONS, bin_to_hex, hex_frame
+from hex_lookup import RESOLUTIONS, grid_cells
+from result_cache import ResultCache, cache_key
+from spatial_index import grid_window
+from streaming import stream_reduce
+from time_catalog import TimeCatalog, filter_period_files
+from zip_source import list_data_files, open_data_files
+
+SERVICE_URL = os.environ.get("AGGREGATION_SERVICE_URL", "")
+SERVICE_HOST = os.environ.get("AGGREGATION_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("AGGREGATION_SERVICE_PORT", "8765"))
+SERVICE_WORKERS = int(os.environ.get("AGGREGATION_SERVICE_WORKERS", str(os.cpu_count() or 1)))
+SERVICE_TIMEOUT = float(os.environ.get("AGGREGATION_SERVICE_TIMEOUT", "600"))
+
+DATA_DIRS = {"Daily": "./GFED5/daily/", "Monthly": "./GFED5/monthly/"}
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def aggregate(data_dir, files, variable, start, stop, resolution, aggr="sum", bbox=None):
+    """
+    Aggregate `variable` over the time window [start, stop) into hexagons.
+
+    Runs on a worker process, which keeps its own dataset pool and the
+    memory-mapped H3 lookup tables between requests.
+
+    Parameters:
+        data_dir (str): Data directory the files belong to.
+        files (list): Local paths of the files overlapping the window, in time order.
+        variable (str): Emission type.
+        start (datetime-like): First time included.
+        stop (datetime-like): First time excluded.
+        resolution (int): H3 resolution.
+        aggr (str): Aggregation type ('sum', 'mean', 'max', 'min').
+        bbox (tuple): Optional (min_lat, min_lon, max_lat, max_lon) to read and
+            bin only that part of the grid.
+
+    Returns:
+        tuple: (uint64 hex ids, float32 values), sorted by hex id.
+    """
+    start, stop = pd.Timestamp(start), pd.Timestamp(stop)
+    slices = TimeCatalog.from_files({data_dir: files}).select(data_dir, start, stop)
+    if not slices:
+        raise FileNotFoundError(f"No data in {data_dir} between {start:%Y-%m-%d} and {stop:%Y-%m-%d}")
+
+    grids, _, _ = stream_reduce(slices, [variable], aggr, bbox=bbox)
+    coords = get_pool().coords(slices[0][0])
+    cells = grid_cells(coords["lat"], coords["lon"], resolution)
+    if bbox is not None:
+        rows, cols = grid_window(coords["lat"], coords["lon"], bbox)
+        cells = cells[rows, cols]
+    hex_ids, values = bin_to_hex(grids[variable], cells)
+    return hex_ids, values.astype(np.float32)
+
+
+def frame_to_arrow(df):
+    """Serialise a `hex_frame` as an Arrow IPC stream."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_to_frame(body):
+    """Read an Arrow IPC stream written by `frame_to_arrow` back into a `hex_frame`."""
+    table = pa.ipc.open_stream(body).read_all()
+    return hex_frame(table["hex_id"].to_numpy(), table["value"].to_numpy())
+
+
+def parse_query(query):
+    """
+    Validate the parameters of an /aggregate request.
+
+    Returns:
+        dict: Keyword arguments for `aggregate`.
+    """
+    params = {name: values[-1] for name, values in urllib.parse.parse_qs(query).items()}
+    missing = [name for name in ("data_type", "variable", "start", "stop", "resolution") if name not in params]
+    if missing:
+        raise ValueError(f"Missing parameters: {', '.join(missing)}")
+    if params["data_type"] not in DATA_DIRS:
+        raise ValueError(f"Unknown data type: {params['data_type']}")
+    resolution = int(params["resolution"])
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unsupported resolution: {resolution}")
+    aggr = params.get("aggr", "sum")
+    if aggr not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation type: {aggr}")
+    bbox = None
+    if params.get("bbox"):
+        bbox = tuple(float(v) for v in params["bbox"].split(","))
+        if len(bbox) != 4:
+            raise ValueError("bbox must be min_lat,min_lon,max_lat,max_lon")
+    return {
+        "data_dir": DATA_DIRS[params["data_type"]],
+        "variable": params["variable"],
+        "start": pd.Timestamp(params["start"]),
+        "stop": pd.Timestamp(params["stop"]),
+        "resolution": resolution,
+        "aggr": aggr,
+        "bbox": bbox,
+    }
+
+
+class AggregationService:
+    """
+    asyncio HTTP front end of a worker process pool.
+
+    Results are kept in a ResultCache keyed by the request parameters; its
+    coalescing means concurrent identical requests wait on one worker job.
+    The event loop only parses requests and writes responses, so it stays
+    responsive however long the jobs take.
+    """
+
+    def __init__(self, workers=SERVICE_WORKERS, cache=None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.cache = cache or ResultCache()
+        self.requests = 0
+        self.failures = 0
+
+    def compute(self, kwargs):
+        # Called on a thread of the loop's default executor; blocks on the worker process
+        key = cache_key("aggregate", sorted(kwargs.items()))
+        return self.cache.get_or_compute(key, lambda: self.run_job(**kwargs))
+
+    def run_job(self, data_dir, start, stop, **kwargs):
+        # Files are listed and extracted the way the app does, here rather than on
+        # the workers, so one process manages the extraction cache and its pins
+        files = filter_period_files(list_data_files(data_dir), start, stop - pd.Timedelta(nanoseconds=1))
+        with open_data_files(data_dir, files) as paths:
+            job = self.executor.submit(aggregate, data_dir, [str(path) for path in paths], start=start, stop=stop, **kwargs)
+            return hex_frame(*job.result())
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            # Headers are not used, but must be read before responding
+            while (await reader.readline()).strip():
+                pass
+            if len(request_line) < 2 or request_line[0] != "GET":
+                await self.respond(writer, 405, {"error": "Only GET is supported"})
+                return
+            url = urllib.parse.urlsplit(request_line[1])
+            if url.path == "/stats":
+                await self.respond(writer, 200, self.stats())
+            elif url.path == "/aggregate":
+                await self.aggregate(writer, url.query)
+            else:
+                await self.respond(writer, 404, {"error": f"Unknown path: {url.path}"})
+        finally:
+            writer.close()
+
+    async def aggregate(self, writer, query):
+        self.requests += 1
+        try:
+            kwargs = parse_query(query)
+        except ValueError as e:
+            self.failures += 1
+            await self.respond(writer, 400, {"error": str(e)})
+            return
+        try:
+            df = await asyncio.get_running_loop().run_in_executor(None, self.compute, kwargs)
+        except FileNotFoundError as e:
+            self.failures += 1
+            await self.respond(writer, 404, {"error": str(e)})
+            return
+        except Exception as e:
+            self.failures += 1
+            await self.respond(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        await self.respond(writer, 200, frame_to_arrow(df), ARROW_STREAM)
+
+    async def respond(self, writer, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+        )
+        writer.write(body)
+        await writer.drain()
+
+    def stats(self):
+        return {"workers": self.workers, "requests": self.requests, "failures": self.failures, **self.cache.stats()}
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Aggregation service on http://{host}:{port} with {self.workers} workers")
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+class AggregationClient:
+    """Blocking client of an AggregationService, for the Streamlit app."""
+
+    def __init__(self, url=SERVICE_URL, timeout=SERVICE_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def aggregate(self, data_type, variable, start, stop, resolution, aggr="sum", bbox=None):
+        """
+        Aggregate `variable` over [start, stop) on the service.
+
+        Parameters:
+            data_type (str): 'Daily' or 'Monthly'.
+            variable (str): Emission type.
+            start (datetime-like): First time included.
+            stop (datetime-like): First time excluded.
+            resolution (int): H3 resolution.
+            aggr (str): Aggregation type.
+            bbox (tuple): Optional (min_lat, min_lon, max_lat, max_lon).
+
+        Returns:
+            pandas.DataFrame: A `hex_frame`.
+        """
+        params = {
+            "data_type": data_type,
+            "variable": variable,
+            "start": pd.Timestamp(start).isoformat(),
+            "stop": pd.Timestamp(stop).isoformat(),
+            "resolution": resolution,
+            "aggr": aggr,
+        }
+        if bbox is not None:
+            params["bbox"] = ",".join(str(v) for v in bbox)
+        return arrow_to_frame(self._get(f"/aggregate?{urllib.parse.urlencode(params)}"))
+
+    def stats(self):
+        return json.loads(self._get("/stats"))
+
+    def _get(self, path):
+        try:
+            with urllib.request.urlopen(self.url + path, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            # The service reports what went wrong as {"error": ...}
+            try:
+                message = json.loads(e.read())["error"]
+            except (ValueError, KeyError):
+                message = e.reason
+            raise RuntimeError(f"Aggregation service: {message}") from None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    args = parser.parse_args(argv)
+
+    service = AggregationService(args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
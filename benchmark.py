@@ -0,0 +1,341 @@
+"""
+Benchmark the data path of the app on synthetic GFED5-shaped data.
+
+`generate` writes daily and monthly NetCDF files with the GFED5 grid, file
+names and variable names, and fire-like sparsity: emissions cluster in
+fire-prone regions and only a few percent of the cells burn on any one step.
+`run` times every stage the app goes through, from selecting files to
+serialising the layer, for Daily and Monthly data, several range lengths,
+every aggregation and H3 resolutions 1-5, and records peak memory. Results
+are JSON, so `compare` can check a run against a baseline.
+
+    python benchmark.py generate --out ./bench_data --months 12 --years 3
+    python benchmark.py run --data ./bench_data --out results.json
+    python benchmark.py compare baseline.json results.json --threshold 1.2
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+import xarray as xr
+
+from hex_binning import AGGREGATIONS, bin_to_hex, display_frame, hex_frame
+from hex_lookup import RESOLUTIONS, build_lookup_tables, grid_cells
+from hex_pyramid import HexPyramid
+from map_component import pack_columns
+from streaming import stream_reduce
+from time_catalog import filter_period_files
+
+GRID_DEG = 0.25
+
+VARIABLES = ("C", "CO2", "CH4")
+
+# Emission factors relative to carbon, roughly those of savanna fires
+SPECIES_FACTORS = {"C": 1.0, "CO2": 3.6, "CO": 0.15, "CH4": 0.005}
+
+
+def gfed_grid(deg=GRID_DEG):
+    """Cell-centre latitudes (north to south) and longitudes of the GFED5 grid."""
+    lat = np.arange(90 - deg / 2, -90, -deg)
+    lon = np.arange(-180 + deg / 2, 180, deg)
+    return lat, lon
+
+
+def fire_mask(rng, lat, lon, coarse_deg=5.0, fire_prone=0.2):
+    """Probability of burning per cell: fire-prone 5° regions, mostly in the tropics."""
+    rows, cols = int(180 / coarse_deg), int(360 / coarse_deg)
+    centres = np.linspace(90 - coarse_deg / 2, -90 + coarse_deg / 2, rows)
+    prone = rng.random((rows, cols)) < fire_prone * 2 * np.cos(np.radians(centres))[:, None]
+    weight = np.where(prone, rng.uniform(0.2, 1.0, (rows, cols)), 0.0)
+    i = np.clip(((90 - lat) / coarse_deg).astype(int), 0, rows - 1)
+    j = np.clip(((lon + 180) / coarse_deg).astype(int), 0, cols - 1)
+    return weight[np.ix_(i, j)]
+
+
+def synthetic_dataset(rng, times, lat, lon, mask, variables, burn_fraction=0.02):
+    """One file's worth of emissions, with about `burn_fraction` of all cells burning per step."""
+    scale = burn_fraction * mask.size / max(mask.sum(), 1e-9)
+    carbon = np.zeros((len(times), len(lat), len(lon)), dtype=np.float32)
+    for t in range(len(times)):
+        burning = rng.random(mask.shape) < mask * scale
+        carbon[t][burning] = rng.lognormal(mean=1.0, sigma=1.5, size=int(burning.sum()))
+    data_vars = {
+        variable: (("time", "lat", "lon"), carbon * np.float32(SPECIES_FACTORS.get(variable, 0.01)))
+        for variable in variables
+    }
+    return xr.Dataset(data_vars, coords={"time": times, "lat": lat, "lon": lon})
+
+
+def generate(out_dir, months=12, years=3, start_year=2020, variables=VARIABLES, deg=GRID_DEG, seed=0):
+    """
+    Write `months` daily files and `years` monthly files under `out_dir`.
+
+    Parameters:
+        out_dir (str): Root directory; files go to `daily/` and `monthly/`.
+        months (int): Number of daily files, one per month from January of `start_year`.
+        years (int): Number of monthly files, one per year from `start_year`.
+        start_year (int): First year of data.
+        variables (list): Variable names to write.
+        deg (float): Grid spacing in degrees.
+        seed (int): Random seed, so runs on the same arguments benchmark the same data.
+    """
+    rng = np.random.default_rng(seed)
+    lat, lon = gfed_grid(deg)
+    mask = fire_mask(rng, lat, lon)
+    encoding = {
+        variable: {"zlib": True, "complevel": 1, "chunksizes": (1, len(lat), len(lon))}
+        for variable in variables
+    }
+
+    out_dir = Path(out_dir)
+    (out_dir / "daily").mkdir(parents=True, exist_ok=True)
+    (out_dir / "monthly").mkdir(parents=True, exist_ok=True)
+    for month in pd.period_range(f"{start_year}-01", periods=months, freq="M"):
+        times = pd.date_range(month.start_time, periods=month.days_in_month, freq="D")
+        path = out_dir / "daily" / f"GFED5_Beta_daily_{month.strftime('%Y%m')}.nc"
+        synthetic_dataset(rng, times, lat, lon, mask, variables).to_netcdf(path, encoding=encoding)
+        print(path)
+    for year in range(start_year, start_year + years):
+        times = pd.date_range(f"{year}-01-01", periods=12, freq="MS")
+        path = out_dir / "monthly" / f"GFED5_Beta_monthly_{year}.nc"
+        # A month of burning: about 30 times the cells of a day
+        synthetic_dataset(rng, times, lat, lon, mask, variables, burn_fraction=0.3).to_netcdf(path, encoding=encoding)
+        print(path)
+
+
+def measure(stage, fn, repeats, **labels):
+    """
+    Time `fn` `repeats` times and trace its peak memory once.
+
+    Returns:
+        tuple: (result of the last call, result record).
+    """
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    record = {
+        "stage": stage,
+        **labels,
+        "min_s": round(min(seconds), 6),
+        "median_s": round(statistics.median(seconds), 6),
+        "peak_bytes": peak,
+    }
+    return result, record
+
+
+def pydeck_json(df):
+    layer = pdk.Layer(
+        "H3HexagonLayer",
+        df,
+        pickable=True,
+        stroked=False,
+        filled=True,
+        get_hexagon="hex_id",
+        get_fill_color="[255, 255 - value, 0]",
+    )
+    return pdk.Deck(layers=[layer], initial_view_state=pdk.ViewState(latitude=0, longitude=0, zoom=1)).to_json()
+
+
+def run(data_dir, variable="C", data_types=("Daily", "Monthly"), lengths=(1, 3, 12),
+        aggrs=AGGREGATIONS, resolutions=RESOLUTIONS, repeats=3):
+    """
+    Benchmark every stage of the app's data path.
+
+    Parameters:
+        data_dir (str): Directory written by `generate`.
+        variable (str): Variable to aggregate.
+        data_types (list): 'Daily' and/or 'Monthly'.
+        lengths (list): Range lengths, in files (months of daily data, years
+            of monthly data); lengths beyond the files available are skipped.
+        aggrs (list): Aggregations.
+        resolutions (list): H3 resolutions.
+        repeats (int): Timed calls per stage.
+
+    Returns:
+        list: One record per stage and parameter combination.
+    """
+    results = []
+    for data_type in data_types:
+        files = sorted(str(file) for file in (Path(data_dir) / data_type.lower()).glob("*.nc"))
+        if not files:
+            continue
+        first = xr.open_dataset(files[0])
+        lat, lon = first["lat"].values, first["lon"].values
+        start_date = pd.Timestamp(first["time"].values[0]).date()
+        first.close()
+        # The app prebuilds its lookup tables; keep building them out of the timings
+        build_lookup_tables(lat, lon, resolutions)
+
+        for length in lengths:
+            if length > len(files):
+                continue
+            if data_type == "Daily":
+                end_date = (pd.Timestamp(start_date) + pd.DateOffset(months=length) - pd.Timedelta(days=1)).date()
+            else:
+                end_date = datetime.date(start_date.year + length - 1, 12, 31)
+            labels = {"data_type": data_type, "files": length}
+
+            filtered_files, record = measure(
+                "filter_files",
+                lambda: filter_period_files(sorted(Path(data_dir, data_type.lower()).glob("*.nc")), start_date, end_date),
+                repeats, **labels,
+            )
+            filtered_files = [str(file) for file in filtered_files]
+            results.append(record)
+
+            for aggr in aggrs:
+                (grids, _, _), record = measure(
+                    "reduce", lambda: stream_reduce(filtered_files, [variable], aggr), repeats, aggr=aggr, **labels
+                )
+                results.append(record)
+                grid = grids[variable]
+                pyramid, record = measure(
+                    "pyramid", lambda: HexPyramid.from_grid(grid, lat, lon, resolutions), repeats, aggr=aggr, **labels
+                )
+                results.append(record)
+
+                for resolution in resolutions:
+                    labels_res = {"aggr": aggr, "resolution": resolution, **labels}
+                    _, record = measure(
+                        "bin", lambda: bin_to_hex(grid, grid_cells(lat, lon, resolution)), repeats, **labels_res
+                    )
+                    results.append(record)
+                    (hex_ids, values), record = measure(
+                        "level", lambda: pyramid.level(resolution), repeats, **labels_res
+                    )
+                    results.append(record)
+                    df, record = measure("hex_frame", lambda: hex_frame(hex_ids, values), repeats, **labels_res)
+                    results.append({**record, "frame_bytes": int(df.memory_usage(index=True, deep=True).sum())})
+                    display, record = measure("display_frame", lambda: display_frame(df), repeats, **labels_res)
+                    results.append({**record, "frame_bytes": int(display.memory_usage(index=True, deep=True).sum())})
+                    payload, record = measure("pydeck_json", lambda: pydeck_json(display), repeats, **labels_res)
+                    results.append({**record, "hexagons": len(df), "payload_bytes": len(payload)})
+                    packed, record = measure("binary_pack", lambda: pack_columns(hex_ids, values), repeats, **labels_res)
+                    results.append({
+                        **record, "hexagons": len(hex_ids), "payload_bytes": sum(len(b) for b in packed.values())
+                    })
+                    print(f"{data_type} x{length} {aggr} res{resolution}: {len(hex_ids)} hexagons", file=sys.stderr)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(record):
+    return tuple((name, record.get(name)) for name in ("stage", "data_type", "files", "aggr", "resolution"))
+
+
+def compare(baseline, current, threshold=1.2, metric="min_s", floor=0.001):
+    """
+    Print the ratio of every shared result of `current` to `baseline`.
+
+    Timings where both runs are under `floor` seconds are too noisy to
+    compare and are skipped.
+
+    Returns:
+        list: The results whose `metric` grew by more than `threshold` times.
+    """
+    before = {result_key(record): record for record in baseline["results"]}
+    regressions = []
+    for record in current["results"]:
+        old = before.get(result_key(record))
+        if old is None or not old[metric]:
+            continue
+        if metric.endswith("_s") and max(old[metric], record[metric]) < floor:
+            continue
+        ratio = record[metric] / old[metric]
+        label = " ".join(f"{name}={value}" for name, value in result_key(record) if value is not None)
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{label}: {old[metric]:.4g} -> {record[metric]:.4g} ({ratio:.2f}x){flag}")
+        if ratio > threshold:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="write synthetic GFED5-shaped NetCDF files")
+    gen.add_argument("--out", default="./bench_data/")
+    gen.add_argument("--months", type=int, default=12)
+    gen.add_argument("--years", type=int, default=3)
+    gen.add_argument("--start-year", type=int, default=2020)
+    gen.add_argument("--variables", nargs="+", default=list(VARIABLES))
+    gen.add_argument("--deg", type=float, default=GRID_DEG)
+    gen.add_argument("--seed", type=int, default=0)
+
+    bench = commands.add_parser("run", help="time every stage and write JSON results")
+    bench.add_argument("--data", default="./bench_data/")
+    bench.add_argument("--out", default="benchmark_results.json")
+    bench.add_argument("--variable", default="C")
+    bench.add_argument("--data-types", nargs="+", choices=["Daily", "Monthly"], default=["Daily", "Monthly"])
+    bench.add_argument("--lengths", nargs="+", type=int, default=[1, 3, 12])
+    bench.add_argument("--aggr", nargs="+", choices=AGGREGATIONS, default=list(AGGREGATIONS))
+    bench.add_argument("--resolutions", nargs="+", type=int, default=list(RESOLUTIONS))
+    bench.add_argument("--repeats", type=int, default=3)
+
+    comp = commands.add_parser("compare", help="compare results to a baseline; exits 1 on regressions")
+    comp.add_argument("baseline")
+    comp.add_argument("current")
+    comp.add_argument("--threshold", type=float, default=1.2)
+    comp.add_argument("--metric", choices=["min_s", "median_s", "peak_bytes"], default="min_s")
+    comp.add_argument("--floor", type=float, default=0.001, help="seconds under which timings are not compared")
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        generate(args.out, args.months, args.years, args.start_year, args.variables, args.deg, args.seed)
+    elif args.command == "run":
+        results = run(
+            args.data, args.variable, args.data_types, args.lengths, args.aggr, args.resolutions, args.repeats
+        )
+        meta = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "xarray": xr.__version__,
+            "pydeck": pdk.__version__,
+            "data": str(args.data),
+            "variable": args.variable,
+            "repeats": args.repeats,
+        }
+        with open(args.out, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"{len(results)} results written to {args.out}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.metric, args.floor)
+        print(f"{len(regressions)} regressions over {args.threshold}x")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+
+from dataset_pool import get_pool
+
+STORE_DIR = os.environ.get("CHUNKED_STORE_DIR", "./cache/chunked/")
+
+# Chunks tuned for "one variable, a contiguous time window, globe or a bounding box":
+# half a month of daily steps (one default streaming chunk of the global grid)
+# and a 4 x 4 spatial tiling of the 0.25 deg grid
+TIME_CHUNK = 16
+LAT_CHUNK = 180
+LON_CHUNK = 360
+
+
+def store_file(data_dir, variable, cache_dir=STORE_DIR):
+    """Consolidated store of `variable` for the files in `data_dir`."""
+    return Path(cache_dir) / Path(data_dir).name / f"{variable}.nc"
+
+
+def convert(data_dir, variable, cache_dir=STORE_DIR, complevel=4):
+    """
+    Rechunk every `.nc` file of `data_dir` into one compressed store for `variable`.
+
+    Time steps of all files are appended in order to a single array chunked
+    as (TIME_CHUNK, LAT_CHUNK, LON_CHUNK). A JSON sidecar records which
+    steps came from which source file, so queries phrased in source files or
+    catalog slices can be translated to the store.
+
+    Parameters:
+        data_dir (str): Directory of source NetCDF files.
+        variable (str): Emission type.
+        cache_dir (str): Root directory of the chunked stores.
+        complevel (int): zlib compression level.
+
+    Returns:
+        pathlib.Path: Path of the written store.
+    """
+    pool = get_pool()
+    files = sorted(Path(data_dir).glob("*.nc"))
+    coords = pool.coords(files[0])
+    path = store_file(data_dir, variable, cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+
+    sources = {}
+    with netCDF4.Dataset(tmp_path, "w") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("lat", len(coords["lat"]))
+        nc.createDimension("lon", len(coords["lon"]))
+        nc.createVariable("lat", "f8", ("lat",))[:] = coords["lat"]
+        nc.createVariable("lon", "f8", ("lon",))[:] = coords["lon"]
+        time = nc.createVariable("time", "i8", ("time",))
+        time.units = "hours since 1970-01-01 00:00:00"
+        data = nc.createVariable(
+            variable, "f4", ("time", "lat", "lon"),
+            chunksizes=(TIME_CHUNK, min(LAT_CHUNK, len(coords["lat"])), min(LON_CHUNK, len(coords["lon"]))),
+            zlib=True, complevel=complevel, shuffle=True,
+        )
+
+        offset = 0
+        for file in files:
+            times = pool.coords(file)["time"]
+            da = pool.get(file)[variable]
+            # Write in whole time chunks to keep peak memory bounded
+            for t in range(0, len(times), TIME_CHUNK):
+                block = da.isel(time=slice(t, t + TIME_CHUNK)).values
+                data[offset + t:offset + t + len(block)] = block
+            hours = (times - np.datetime64("1970-01-01")) // np.timedelta64(1, "h")
+            time[offset:offset + len(times)] = hours
+            sources[file.stem] = [offset, offset + len(times)]
+            offset += len(times)
+
+    os.replace(tmp_path, path)
+    with open(path.with_suffix(".json"), "w") as f:
+        json.dump(sources, f)
+    return path
+
+
+class ChunkedStore:
+    """Translates source files or catalog slices into slices of a chunked store."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path.with_suffix(".json")) as f:
+            self.sources = json.load(f)
+
+    @classmethod
+    def open(cls, filtered_files, variable, cache_dir=STORE_DIR):
+        """Return the store covering `filtered_files`, or None if it does not exist or is incomplete."""
+        files = [entry[0] if isinstance(entry, tuple) else entry for entry in filtered_files]
+        path = store_file(Path(files[0]).parent, variable, cache_dir)
+        if not path.with_suffix(".json").exists():
+            return None
+        store = cls(path)
+        if not all(Path(file).stem in store.sources for file in files):
+            return None
+        return store
+
+    def slices(self, filtered_files):
+        """
+        Map source files or `(file, start, stop)` slices onto the store.
+
+        Returns:
+            list: `(store_file, start, stop)` slices for `stream_reduce`, with
+            adjacent ranges merged into one contiguous read.
+        """
+        slices = []
+        for entry in filtered_files:
+            file, start, stop = entry if isinstance(entry, tuple) else (entry, 0, None)
+            base, end = self.sources[Path(file).stem]
+            start, stop = base + start, end if stop is None else base + stop
+            if slices and slices[-1][2] == start:
+                slices[-1] = (slices[-1][0], slices[-1][1], stop)
+            else:
+                slices.append((str(self.path), start, stop))
+        return slices
+
+
+if __name__ == "__main__":
+    # One-shot conversion per data directory and variable:
+    #   python chunked_store.py ./GFED5/daily C CO2 CH4
+    for variable in sys.argv[2:]:
+        print(convert(sys.argv[1], variable))
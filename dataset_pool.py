@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+
+import xarray as xr
+
+POOL_SIZE = int(os.environ.get("DATASET_POOL_SIZE", "64"))
+
+
+class DatasetPool:
+    """
+    Process-wide pool of open GFED5 datasets.
+
+    Each file is opened once (lazily, dask-backed) and kept until it is the
+    least recently used handle and the pool is full. Decoded coordinates are
+    cached separately and survive eviction of their handle. Evicted datasets
+    are closed; arrays already taken from them keep working because xarray
+    reopens the underlying file on access.
+    """
+
+    def __init__(self, max_open=POOL_SIZE):
+        self.max_open = max_open
+        self._datasets = OrderedDict()
+        self._coords = {}
+        self._lock = threading.Lock()
+
+    def get(self, file):
+        """Return the open dataset for `file`, opening it on first use."""
+        file = str(file)
+        with self._lock:
+            ds = self._datasets.get(file)
+            if ds is not None:
+                self._datasets.move_to_end(file)
+                return ds
+
+        ds = xr.open_dataset(file, chunks={})
+        with self._lock:
+            # Another thread may have opened the same file meanwhile
+            if file in self._datasets:
+                ds.close()
+                self._datasets.move_to_end(file)
+                return self._datasets[file]
+            self._datasets[file] = ds
+            while len(self._datasets) > self.max_open:
+                _, evicted = self._datasets.popitem(last=False)
+                evicted.close()
+        return ds
+
+    def is_open(self, file):
+        """Whether the pool holds an open handle on `file`."""
+        with self._lock:
+            return str(file) in self._datasets
+
+    def coords(self, file):
+        """Return the decoded `time`, `lat` and `lon` of `file` as numpy arrays."""
+        file = str(file)
+        coords = self._coords.get(file)
+        if coords is None:
+            ds = self.get(file)
+            coords = {name: ds[name].values for name in ("time", "lat", "lon")}
+            self._coords[file] = coords
+        return coords
+
+    def close(self):
+        with self._lock:
+            while self._datasets:
+                _, ds = self._datasets.popitem()
+                ds.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide DatasetPool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DatasetPool()
+        return _pool
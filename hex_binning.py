@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import h3
+
+from instrumentation import stage
+
+AGGREGATIONS = ("sum", "mean", "max", "min")
+
+
+def reduce_time(ds, aggr):
+    """
+    Reduce a DataArray over its time dimension.
+
+    Parameters:
+        ds (xarray.DataArray): Emission data with a `time` dimension.
+        aggr (str): Aggregation type ('sum', 'mean', 'max', 'min').
+
+    Returns:
+        xarray.DataArray: The reduced array.
+    """
+    if aggr not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation type: {aggr}")
+    return getattr(ds, aggr)(dim="time")
+
+
+def latlng_to_cells(lat, lon, resolution):
+    """
+    Map paired latitude/longitude arrays to integer H3 cell ids.
+
+    Parameters:
+        lat (array-like): Latitudes in degrees.
+        lon (array-like): Longitudes in degrees, same shape as `lat`.
+        resolution (int): H3 resolution.
+
+    Returns:
+        numpy.ndarray: uint64 cell ids with the shape of `lat`.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    to_cell = h3.api.basic_int.latlng_to_cell
+    cells = np.fromiter(
+        (to_cell(la, lo, resolution) for la, lo in zip(lat.ravel().tolist(), lon.ravel().tolist())),
+        dtype=np.uint64,
+        count=lat.size,
+    )
+    return cells.reshape(lat.shape)
+
+
+def segment_reduce(codes, values, n, how="sum"):
+    """
+    Reduce `values` into `n` segments labelled by integer `codes`.
+
+    Parameters:
+        codes (numpy.ndarray): Segment label in [0, n) for every value.
+        values (numpy.ndarray): Values to reduce.
+        n (int): Number of segments.
+        how (str): Reduction ('sum', 'mean', 'max', 'min').
+
+    Returns:
+        numpy.ndarray: Array of length `n` in the floating dtype of `values`.
+    """
+    if how not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation type: {how}")
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+    if how in ("sum", "mean"):
+        # Unbuffered in-order adds, so sums match a sequential loop bit for bit
+        out = np.zeros(n, dtype=values.dtype)
+        np.add.at(out, codes, values)
+        if how == "mean":
+            out = out / np.bincount(codes, minlength=n)
+        return out
+
+    # Sort into contiguous segments and reduce each run in one call;
+    # fmax/fmin skip NaNs, which callers use to mark missing values
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ufunc = np.fmax if how == "max" else np.fmin
+    out = np.full(n, np.nan, dtype=values.dtype)
+    if len(order):
+        out[sorted_codes[starts]] = ufunc.reduceat(values[order], starts)
+    return out
+
+
+def bin_to_hex(values, cells, how="sum"):
+    """
+    Aggregate per-cell values into H3 hexagons using array reductions.
+
+    Only positive values are binned. Hexagons are returned in the order
+    they are first encountered in a row-major scan of the grid.
+
+    Parameters:
+        values (array-like): Per-cell values, e.g. a time-reduced grid.
+        cells (array-like): H3 cell id for every value, same shape.
+        how (str): Spatial reduction ('sum', 'mean', 'max', 'min').
+
+    Returns:
+        tuple: (uint64 hex ids, aggregated values).
+    """
+    values = np.asarray(values).ravel()
+    cells = np.asarray(cells).ravel()
+    keep = values > 0
+    values = values[keep]
+    cells = cells[keep]
+
+    hex_ids, first, codes = np.unique(cells, return_index=True, return_inverse=True)
+    aggregated = segment_reduce(codes.ravel(), values, len(hex_ids), how)
+
+    order = np.argsort(first, kind="stable")
+    return hex_ids[order], aggregated[order]
+
+
+def hex_frame(hex_ids, values):
+    """
+    Build the compact DataFrame of an aggregation result.
+
+    Results are cached, spilled and diffed in this form: 12 bytes per hexagon
+    instead of a Python string and a float64. Only `display_frame` turns
+    them into H3 strings, for layers serialised to JSON.
+
+    Parameters:
+        hex_ids (numpy.ndarray): uint64 H3 cell ids.
+        values (numpy.ndarray): Aggregated values.
+
+    Returns:
+        pandas.DataFrame: Columns `hex_id` (uint64) and `value` (float32).
+    """
+    with stage("hex_frame", hexagons=len(hex_ids)):
+        return pd.DataFrame({
+            "hex_id": np.asarray(hex_ids, dtype=np.uint64),
+            "value": np.asarray(values, dtype=np.float32),
+        })
+
+
+def display_frame(df):
+    """
+    Convert a `hex_frame` for the pydeck H3HexagonLayer.
+
+    JSON numbers cannot hold 64-bit H3 indices, so the layer gets H3 strings,
+    and values rounded to 2 decimals to keep the payload small.
+
+    Parameters:
+        df (pandas.DataFrame): Columns `hex_id` (uint64) and `value`.
+
+    Returns:
+        pandas.DataFrame: Columns `hex_id` (H3 string) and `value` (float64).
+    """
+    with stage("display_frame", hexagons=len(df)):
+        return pd.DataFrame({
+            "hex_id": pd.Series([h3.int_to_str(h) for h in df["hex_id"].tolist()], dtype=object),
+            "value": df["value"].to_numpy(dtype=np.float64).round(2),
+        })
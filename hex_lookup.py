@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from hex_binning import latlng_to_cells
+
+# Resolutions offered by the "H3 Resolution" sidebar slider
+RESOLUTIONS = (1, 2, 3, 4, 5)
+
+LOOKUP_DIR = os.environ.get("HEX_LOOKUP_DIR", "./cache/hex_lookup/")
+
+# Memory-mapped tables already opened by this process
+_open_tables = {}
+
+
+def grid_fingerprint(lat, lon):
+    """
+    Return a short, stable fingerprint of a lat/lon grid.
+
+    Parameters:
+        lat (array-like): 1-D grid latitudes.
+        lon (array-like): 1-D grid longitudes.
+
+    Returns:
+        str: Hex digest identifying the grid.
+    """
+    lat = np.ascontiguousarray(lat, dtype=np.float64)
+    lon = np.ascontiguousarray(lon, dtype=np.float64)
+    digest = hashlib.sha1()
+    digest.update(np.array([lat.size, lon.size], dtype=np.int64).tobytes())
+    digest.update(lat.tobytes())
+    digest.update(lon.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def lookup_path(fingerprint, resolution, cache_dir=LOOKUP_DIR):
+    return Path(cache_dir) / fingerprint / f"res{int(resolution)}.npy"
+
+
+def build_lookup_table(lat, lon, resolution, cache_dir=LOOKUP_DIR):
+    """
+    Compute the grid -> H3 cell table for one resolution and store it on disk.
+
+    The file is written under a temporary name and renamed into place, so
+    concurrent readers never see a partial table.
+
+    Parameters:
+        lat (array-like): 1-D grid latitudes.
+        lon (array-like): 1-D grid longitudes.
+        resolution (int): H3 resolution.
+        cache_dir (str): Root directory of the lookup cache.
+
+    Returns:
+        pathlib.Path: Path of the written table.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    path = lookup_path(grid_fingerprint(lat, lon), resolution, cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    lat2d, lon2d = np.meshgrid(lat, lon, indexing="ij")
+    cells = latlng_to_cells(lat2d, lon2d, resolution)
+
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp_path, cells)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_lookup_tables(lat, lon, resolutions=RESOLUTIONS, cache_dir=LOOKUP_DIR):
+    """Build (or rebuild) the tables for every resolution in `resolutions`."""
+    return [build_lookup_table(lat, lon, res, cache_dir) for res in resolutions]
+
+
+def grid_cells(lat, lon, resolution, cache_dir=LOOKUP_DIR):
+    """
+    Return the H3 cell id of every cell of a regular lat/lon grid.
+
+    Tables are read from the on-disk cache as read-only memory maps and built
+    on first use, so after the first run this costs a file map instead of
+    one H3 call per grid cell.
+
+    Parameters:
+        lat (array-like): 1-D grid latitudes.
+        lon (array-like): 1-D grid longitudes.
+        resolution (int): H3 resolution.
+        cache_dir (str): Root directory of the lookup cache.
+
+    Returns:
+        numpy.ndarray: uint64 array of shape (len(lat), len(lon)).
+    """
+    path = lookup_path(grid_fingerprint(lat, lon), resolution, cache_dir)
+    cells = _open_tables.get(path)
+    if cells is None:
+        if not path.exists():
+            build_lookup_table(lat, lon, resolution, cache_dir)
+        cells = np.load(path, mmap_mode="r")
+        _open_tables[path] = cells
+    return cells
+
+
+if __name__ == "__main__":
+    # Prebuild all tables from the grid of a GFED5 file:
+    #   python hex_lookup.py ./GFED5/monthly/GFED5_Beta_monthly_2022.nc
+    import xarray as xr
+
+    with xr.open_dataset(sys.argv[1]) as ds:
+        for table in build_lookup_tables(ds["lat"].values, ds["lon"].values):
+            print(table)
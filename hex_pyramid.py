@@ -0,0 +1,139 @@
+import numpy as np
+
+from hex_binning import AGGREGATIONS, segment_reduce
+from hex_lookup import RESOLUTIONS, grid_cells
+
+
+class HexPyramid:
+    """
+    Per-hexagon partial aggregates for every H3 resolution, built in one pass.
+
+    Grid cells are grouped into base units: cells that share the same hexagon
+    at every resolution. Each unit keeps the sum, count, min and max of its
+    positive cell values, so any level is a segment reduction over the units
+    and needs no NetCDF I/O. A pyramid can hold several value columns (e.g.
+    one per emission type) over the same base units.
+
+    H3 is not strictly nested, so a cell's containing hexagon at a coarse
+    resolution is not always the parent of its fine one. Levels are therefore
+    rolled up through the lookup table of each resolution rather than
+    `h3.cell_to_parent`, which keeps them identical to binning directly.
+    """
+
+    def __init__(self, level_cells, first, sums, counts, mins, maxs):
+        self.level_cells = level_cells
+        self.first = first
+        self.sums = sums
+        self.counts = counts
+        self.mins = mins
+        self.maxs = maxs
+
+    @classmethod
+    def from_grid(cls, values, lat, lon, resolutions=RESOLUTIONS):
+        """
+        Build the pyramid from time-reduced grids.
+
+        Parameters:
+            values (array-like): Grid of shape (len(lat), len(lon)), or a stack
+                of grids of shape (columns, len(lat), len(lon)).
+            lat (array-like): 1-D grid latitudes.
+            lon (array-like): 1-D grid longitudes.
+            resolutions (tuple): H3 resolutions to support.
+
+        Returns:
+            HexPyramid: The pyramid.
+        """
+        values = np.asarray(values)
+        grids = values.reshape(-1, len(lat) * len(lon))
+        positive = grids > 0
+        keep = np.flatnonzero(positive.any(axis=0))
+
+        # One column per resolution; a base unit is a distinct row
+        columns = np.column_stack([
+            np.asarray(grid_cells(lat, lon, res)).ravel()[keep] for res in resolutions
+        ])
+        units, codes = np.unique(columns, axis=0, return_inverse=True)
+        codes = codes.ravel()
+        n = len(units)
+
+        first, sums, counts, mins, maxs = [], [], [], [], []
+        for grid, mask in zip(grids, positive):
+            mask = mask[keep]
+            column = np.where(mask, grid[keep], np.nan)
+            unit_first = np.full(n, np.iinfo(np.int64).max)
+            np.minimum.at(unit_first, codes[mask], keep[mask])
+            first.append(unit_first)
+            sums.append(segment_reduce(codes, np.where(mask, column, 0).astype(np.float64), n, "sum"))
+            counts.append(np.bincount(codes, weights=mask, minlength=n).astype(np.int32))
+            mins.append(segment_reduce(codes, column, n, "min"))
+            maxs.append(segment_reduce(codes, column, n, "max"))
+
+        return cls(
+            level_cells={res: units[:, i] for i, res in enumerate(resolutions)},
+            first=np.column_stack(first),
+            sums=np.column_stack(sums),
+            counts=np.column_stack(counts),
+            mins=np.column_stack(mins),
+            maxs=np.column_stack(maxs),
+        )
+
+    @property
+    def resolutions(self):
+        return tuple(self.level_cells)
+
+    def table(self, resolution, how="sum"):
+        """
+        Roll every column up to one resolution.
+
+        Parameters:
+            resolution (int): H3 resolution, one of `self.resolutions`.
+            how (str): Spatial reduction ('sum', 'mean', 'max', 'min').
+
+        Returns:
+            tuple: (uint64 hex ids, 2-D array of values with one column per
+            pyramid column, first grid cell per hex and column). Values are
+            NaN where a hexagon has no positive cell in that column.
+        """
+        if how not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation type: {how}")
+        if resolution not in self.level_cells:
+            raise ValueError(f"Resolution {resolution} is not in this pyramid: {self.resolutions}")
+
+        hex_ids, codes = np.unique(self.level_cells[resolution], return_inverse=True)
+        codes = codes.ravel()
+        n = len(hex_ids)
+
+        values = np.empty((n, self.sums.shape[1]))
+        first = np.full((n, self.sums.shape[1]), np.iinfo(np.int64).max)
+        for i in range(self.sums.shape[1]):
+            counts = np.bincount(codes, weights=self.counts[:, i], minlength=n)
+            if how in ("sum", "mean"):
+                values[:, i] = segment_reduce(codes, self.sums[:, i], n, "sum")
+                if how == "mean":
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        values[:, i] /= counts
+            elif how == "max":
+                values[:, i] = segment_reduce(codes, self.maxs[:, i], n, "max")
+            else:
+                values[:, i] = segment_reduce(codes, self.mins[:, i], n, "min")
+            values[counts == 0, i] = np.nan
+            np.minimum.at(first[:, i], codes, self.first[:, i])
+        return hex_ids, values, first
+
+    def level(self, resolution, how="sum", column=0):
+        """
+        Roll one column up to one resolution.
+
+        Parameters:
+            resolution (int): H3 resolution, one of `self.resolutions`.
+            how (str): Spatial reduction ('sum', 'mean', 'max', 'min').
+            column (int): Pyramid column to return.
+
+        Returns:
+            tuple: (uint64 hex ids, float64 values), hexagons ordered by their
+            first grid cell in a row-major scan.
+        """
+        hex_ids, values, first = self.table(resolution, how)
+        present = ~np.isnan(values[:, column])
+        order = np.argsort(first[present, column], kind="stable")
+        return hex_ids[present][order], values[present, column][order]
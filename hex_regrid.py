@@ -0,0 +1,258 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from dataset_pool import get_pool
+from hex_binning import AGGREGATIONS
+from hex_lookup import grid_cells
+from streaming import CHUNK_BYTES
+
+CUBE_DIR = os.environ.get("HEX_CUBE_DIR", "./cache/hex_cube/")
+
+EARTH_RADIUS_KM = 6371.0088
+
+WEIGHTINGS = (None, "area", "area_mean")
+
+
+def cube_path(data_dir, variable, resolution, weighting=None, cache_dir=CUBE_DIR):
+    """Directory holding the hex x time cube of `variable` for the files in `data_dir`."""
+    name = f"res{resolution}" if weighting is None else f"res{resolution}_{weighting}"
+    return Path(cache_dir) / Path(data_dir).name / variable / name
+
+
+def cell_areas(lat, lon):
+    """Area in km² of every cell of a regular lat/lon grid, shape (len(lat), len(lon))."""
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    d_lat = abs(lat[1] - lat[0]) if len(lat) > 1 else 180.0
+    d_lon = abs(lon[1] - lon[0]) if len(lon) > 1 else 360.0
+    top = np.radians(np.clip(lat + d_lat / 2, -90, 90))
+    bottom = np.radians(np.clip(lat - d_lat / 2, -90, 90))
+    band = EARTH_RADIUS_KM ** 2 * np.radians(d_lon) * (np.sin(top) - np.sin(bottom))
+    return np.repeat(band[:, None], len(lon), axis=1)
+
+
+class RegridMatrix:
+    """
+    Sparse (hexagon x grid cell) aggregation matrix in CSR layout.
+
+    Row `i` aggregates the flat grid cells `cells[indptr[i]:indptr[i + 1]]`
+    into hexagon `hex_ids[i]` with `weights` (all ones when None). Applying it
+    to a block of time steps is one gather and one segmented sum, which gives
+    every hexagon's value at every step at once. Rows are never empty.
+    """
+
+    def __init__(self, hex_ids, indptr, cells, weights=None):
+        self.hex_ids = hex_ids
+        self.indptr = indptr
+        self.cells = cells
+        self.weights = weights
+
+    @classmethod
+    def from_grid(cls, lat, lon, resolution, weighting=None, cells=None):
+        """
+        Build the matrix from the H3 lookup table of a grid.
+
+        Parameters:
+            lat (array-like): 1-D grid latitudes.
+            lon (array-like): 1-D grid longitudes.
+            resolution (int): H3 resolution.
+            weighting (str): None to sum cell values (like `bin_to_hex`),
+                'area' to sum values times cell area (densities to totals), or
+                'area_mean' for the area-weighted mean of the cells.
+            cells (array-like): Flat cell indices to include; all cells by default.
+
+        Returns:
+            RegridMatrix: The matrix, with rows sorted by H3 index.
+        """
+        if weighting not in WEIGHTINGS:
+            raise ValueError(f"Unknown weighting: {weighting}")
+        codes = np.asarray(grid_cells(lat, lon, resolution)).ravel()
+        cells = np.arange(codes.size) if cells is None else np.asarray(cells, dtype=np.int64)
+        cells = cells[np.argsort(codes[cells], kind="stable")]
+        hex_ids, starts = np.unique(codes[cells], return_index=True)
+        indptr = np.append(starts, len(cells)).astype(np.int64)
+
+        weights = None
+        if weighting is not None:
+            weights = cell_areas(lat, lon).ravel()[cells]
+            if weighting == "area_mean" and len(cells):
+                weights = weights / np.repeat(np.add.reduceat(weights, starts), np.diff(indptr))
+        return cls(hex_ids, indptr, cells, weights)
+
+    @property
+    def shape(self):
+        return len(self.hex_ids), len(self.cells)
+
+    def apply(self, block):
+        """
+        Aggregate a block of grids into hexagons.
+
+        Parameters:
+            block (numpy.ndarray): (time, lat, lon) or (time, cells) values;
+                NaNs count as zero.
+
+        Returns:
+            numpy.ndarray: float64 array of shape (hexagons, time).
+        """
+        block = np.asarray(block)
+        block = block.reshape(len(block), -1)[:, self.cells].astype(np.float64)
+        np.nan_to_num(block, copy=False)
+        if self.weights is not None:
+            block *= self.weights
+        if not len(self.cells):
+            return np.zeros((0, len(block)))
+        return np.add.reduceat(block, self.indptr[:-1], axis=1).T
+
+
+class HexCube:
+    """
+    Time x hexagon values of one variable at one resolution.
+
+    Only hexagons that are nonzero at some step are kept, sorted by H3 index.
+    Values are stored time-major next to their cumulative sums along time, so
+    the sum or mean of any window is two row reads, max and min read just the
+    window's rows, and a hexagon's series is one column. Windows are
+    half-open, [start, stop), on the time coordinate.
+    """
+
+    def __init__(self, hex_ids, times, values, csum):
+        self.hex_ids = hex_ids
+        self.times = times
+        self.values = values
+        self.csum = csum
+
+    @classmethod
+    def build(cls, filtered_files, variable, resolution, path, weighting=None, chunk_bytes=CHUNK_BYTES, pool=None):
+        """
+        Regrid `variable` from the files in time order into a cube at `path`.
+
+        Chunks are written to memory-mapped files as they are regridded, so
+        memory stays at one chunk. The cube replaces any previous one at
+        `path` once it is complete.
+
+        Parameters:
+            filtered_files (list): File paths, or `(file, start, stop)` catalog slices.
+            variable (str): Emission type.
+            resolution (int): H3 resolution.
+            path (str or Path): Cube directory.
+            weighting (str): See `RegridMatrix.from_grid`.
+            chunk_bytes (int): Read budget per chunk.
+            pool (DatasetPool): Pool to read from; the process-wide pool by default.
+
+        Returns:
+            HexCube: The cube, memory-mapped from `path`.
+        """
+        pool = pool or get_pool()
+        entries = [entry if isinstance(entry, tuple) else (entry, 0, None) for entry in filtered_files]
+        coords = pool.coords(entries[0][0])
+        lat, lon = coords["lat"], coords["lon"]
+        steps = max(1, chunk_bytes // (len(lat) * len(lon) * 4))
+
+        def blocks():
+            for file, start, stop in entries:
+                da = pool.get(file)[variable]
+                stop = da.sizes["time"] if stop is None else stop
+                for t in range(start, stop, steps):
+                    yield da.isel(time=slice(t, min(t + steps, stop))).values
+
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        # First pass: cells that are ever nonzero; no other cell can reach a hexagon
+        active = np.zeros(len(lat) * len(lon), dtype=bool)
+        for block in blocks():
+            active |= (np.nan_to_num(block.reshape(len(block), -1)) != 0).any(axis=0)
+        matrix = RegridMatrix.from_grid(lat, lon, resolution, weighting, cells=np.flatnonzero(active))
+
+        # Second pass: one matrix application per chunk of time steps, noting
+        # the hexagons that are ever nonzero
+        times = np.concatenate([pool.coords(file)["time"][start:stop] for file, start, stop in entries])
+        regridded = np.lib.format.open_memmap(
+            tmp / "regridded.npy", mode="w+", dtype=np.float32, shape=(len(times), len(matrix.hex_ids))
+        )
+        keep = np.zeros(len(matrix.hex_ids), dtype=bool)
+        t = 0
+        for block in blocks():
+            block = matrix.apply(block).T
+            regridded[t:t + len(block)] = block
+            keep |= (block != 0).any(axis=0)
+            t += len(block)
+
+        # Third pass: copy the kept hexagons and their running sums, chunk by chunk
+        kept = int(keep.sum())
+        values = np.lib.format.open_memmap(tmp / "values.npy", mode="w+", dtype=np.float32, shape=(len(times), kept))
+        csum = np.lib.format.open_memmap(tmp / "csum.npy", mode="w+", dtype=np.float64, shape=(len(times) + 1, kept))
+        csum[0] = 0
+        for t in range(0, len(times), steps):
+            block = regridded[t:t + steps][:, keep]
+            values[t:t + len(block)] = block
+            csum[t + 1:t + len(block) + 1] = csum[t] + np.cumsum(block, axis=0, dtype=np.float64)
+
+        for array in (values, csum):
+            array.flush()
+        del regridded, values, csum
+        os.remove(tmp / "regridded.npy")
+        np.save(tmp / "hex_ids.npy", matrix.hex_ids[keep])
+        np.save(tmp / "times.npy", times)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a cube written by `build`."""
+        path = Path(path)
+        return cls(**{name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ("hex_ids", "times", "values", "csum")})
+
+    def bounds(self, start, stop):
+        """Return the row range [s, e) of the time steps in [start, stop)."""
+        s = int(np.searchsorted(self.times, np.datetime64(start, "ns"), side="left"))
+        e = int(np.searchsorted(self.times, np.datetime64(stop, "ns"), side="left"))
+        return s, max(s, e)
+
+    def window(self, start, stop, aggr="sum"):
+        """
+        Aggregate every hexagon over the time window [start, stop).
+
+        Parameters:
+            start (datetime-like): First time included.
+            stop (datetime-like): First time excluded.
+            aggr (str): Aggregation of the hexagon's per-step values.
+
+        Returns:
+            numpy.ndarray: float64 value per hexagon in `self.hex_ids`; NaN
+            where the window is empty.
+        """
+        if aggr not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation type: {aggr}")
+        s, e = self.bounds(start, stop)
+        if s == e:
+            return np.full(len(self.hex_ids), np.nan)
+        if aggr in ("sum", "mean"):
+            total = self.csum[e] - self.csum[s]
+            return total if aggr == "sum" else total / (e - s)
+        window = self.values[s:e]
+        return (window.max(axis=0) if aggr == "max" else window.min(axis=0)).astype(np.float64)
+
+    def series(self, hex_id):
+        """Return the float32 per-step values of `hex_id`, or None if it was never nonzero."""
+        i = int(np.searchsorted(self.hex_ids, np.uint64(hex_id)))
+        if i == len(self.hex_ids) or self.hex_ids[i] != np.uint64(hex_id):
+            return None
+        return np.asarray(self.values[:, i])
+
+
+if __name__ == "__main__":
+    # Ingest step, run once per data directory, resolution and variable:
+    #   python hex_regrid.py ./GFED5/daily 4 C CO2 CH4
+    data_dir, resolution, variables = sys.argv[1], int(sys.argv[2]), sys.argv[3:]
+    files = [str(file) for file in sorted(Path(data_dir).glob("*.nc"))]
+    for variable in variables:
+        HexCube.build(files, variable, resolution, cube_path(data_dir, variable, resolution))
+        print(cube_path(data_dir, variable, resolution))
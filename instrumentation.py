@@ -0,0 +1,169 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+METRICS_LOG = os.environ.get("METRICS_LOG", "./logs/metrics.jsonl")
+METRICS_LOG_BYTES = int(os.environ.get("METRICS_LOG_BYTES", str(64 * 2**20)))
+
+# Counters summed over a stage and everything below it
+COUNTERS = ("bytes_read", "read_seconds", "payload_bytes")
+
+
+class RequestTrace:
+    """
+    Per-stage timings of one script run.
+
+    Stages nest: each records its wall time, its depth below the request and
+    any fields the code inside it reports (bytes read, hexagon count, payload
+    size, cache hit or miss). Stages are listed in the order they started.
+    """
+
+    def __init__(self, request_id=None, **params):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.params = params
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.stages = []
+        self.seconds = None
+        self._open = []
+
+    @contextlib.contextmanager
+    def stage(self, name, cached=False, **fields):
+        record = {"stage": name, "depth": len(self._open), **fields}
+        self.stages.append(record)
+        self._open.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 6)
+            # A cached function body that ran would have reported the miss
+            if cached:
+                record.setdefault("cache", "hit")
+            self._open.pop()
+
+    def note(self, **fields):
+        """Set fields on the innermost open stage."""
+        if self._open:
+            self._open[-1].update(fields)
+
+    def count(self, **counts):
+        """Add to counters of the innermost open stage."""
+        if self._open:
+            record = self._open[-1]
+            for name, value in counts.items():
+                record[name] = record.get(name, 0) + value
+
+    def finish(self):
+        self.seconds = round(time.perf_counter() - self.started, 6)
+        # Roll counters up so every stage reports what happened beneath it
+        for i in range(len(self.stages) - 1, -1, -1):
+            record = self.stages[i]
+            for child in self.stages[i + 1:]:
+                if child["depth"] <= record["depth"]:
+                    break
+                if child["depth"] == record["depth"] + 1:
+                    for name in COUNTERS:
+                        if name in child:
+                            record[name] = record.get(name, 0) + child[name]
+        return self
+
+    def to_dict(self):
+        return {
+            "timestamp": round(self.timestamp, 3),
+            "request_id": self.request_id,
+            "seconds": self.seconds,
+            "params": self.params,
+            "stages": self.stages,
+        }
+
+
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def start_request(**params):
+    """Start tracing the current script run and return its trace."""
+    trace = RequestTrace(**params)
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextlib.contextmanager
+def stage(name, cached=False, **fields):
+    """
+    Time a stage of the current request.
+
+    Yields the stage record, to which the body may add fields. Outside a
+    traced run (prefetch threads, the batch tools) this only yields a
+    throwaway dict, so library code can call it unconditionally.
+
+    Parameters:
+        name (str): Stage name.
+        cached (bool): The stage calls a cached function whose body calls
+            `note(cache="miss")`; the stage is marked a hit otherwise.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield dict(fields)
+        return
+    with trace.stage(name, cached, **fields) as record:
+        yield record
+
+
+def note(**fields):
+    trace = _trace.get()
+    if trace is not None:
+        trace.note(**fields)
+
+
+def count(**counts):
+    trace = _trace.get()
+    if trace is not None:
+        trace.count(**counts)
+
+
+class MetricsLog:
+    """
+    Append-only JSON Lines log of finished request traces.
+
+    Writes are serialised across sessions; when the file exceeds `max_bytes`
+    it is rotated to `<path>.1`, replacing the previous rotation.
+    """
+
+    def __init__(self, path=METRICS_LOG, max_bytes=METRICS_LOG_BYTES):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def write(self, trace):
+        if self.path is None:
+            return
+        line = json.dumps(trace.to_dict(), default=str) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_metrics_log():
+    """Return the process-wide MetricsLog."""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = MetricsLog()
+        return _log
@@ -1,85 +1,369 @@
 import streamlit as st
-import xarray as xr
+import numpy as np
 import pandas as pd
 import pydeck as pdk
+import h3
 from pathlib import Path
 from streamlit_js_eval import streamlit_js_eval
-import h3
-from collections import defaultdict
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import contextlib
+import datetime
 import os
+from functools import partial
+import time
+
+from hex_binning import AGGREGATIONS, bin_to_hex, display_frame, hex_frame
+from hex_lookup import grid_cells
+from hex_pyramid import HexPyramid
+from temporal_index import TemporalIndex, index_path
+from time_catalog import TimeCatalog, filter_period_files
+from streaming import stream_reduce
+from sparse_store import SparseStore, source_files
+from chunked_store import ChunkedStore
+from result_cache import cached_result, get_result_cache
+from zip_source import DATA_ZIP, list_data_files, open_data_files
+from hex_regrid import HexCube, cube_path
+from spatial_index import HexIndex, lod_resolution, pad_bounds, viewport_bounds
+from map_component import map_component
+from prefetch import get_prefetcher
+from precomputed import Manifest, period_label, read_output
+from instrumentation import get_metrics_log, note, stage, start_request
+from aggregation_service import SERVICE_URL, AggregationClient
 
 st.set_page_config(layout="wide")
 
-# Check if DAILY_DATA_DIR and MONTHLY_DATA_DIR exist, if not, download and extract
+# Per-stage timings of this run, logged when it ends
+trace = start_request()
+
+# Prefetch work is queued per browser session, so sessions do not cancel each other's
+session_id = getattr(get_script_run_ctx(), "session_id", None)
+
+# Zip members extracted for this run stay on disk until it ends
+run_pins = contextlib.ExitStack()
+
+
+# Fraction of the viewport span sent around it, so small pans need no new data
+VIEWPORT_MARGIN = 0.25
+
+# Hexagon budget per frame in automatic resolution mode
+MAX_HEXES_PER_FRAME = int(os.environ.get("MAX_HEXES_PER_FRAME", "50000"))
+
+# Timeline frames computed ahead of the one shown
+PREFETCH_FRAMES = int(os.environ.get("PREFETCH_FRAMES", "8"))
+
+# Check if DAILY_DATA_DIR and MONTHLY_DATA_DIR exist, if not, download the archive.
+# It is not unpacked: members are extracted on demand when a query touches them.
 if not os.path.exists("./GFED5/daily/") or not os.path.exists("./GFED5/monthly/"):
-    st.warning("Data directories do not exist. Downloading data...")
-    os.system("wget -O gfed_data.zip https://surfdrive.surf.nl/files/index.php/s/VPMEYinPeHtWVxn/download")
-    st.warning("Extracting data...")
-    os.system("unzip gfed_data.zip -d ./GFED5/")  # Make sure unzip is installed
-    st.success("Download and extraction complete.")
+    if not os.path.exists(DATA_ZIP):
+        st.warning("Data directories do not exist. Downloading data...")
+        os.system(f"wget -O {DATA_ZIP} https://surfdrive.surf.nl/files/index.php/s/VPMEYinPeHtWVxn/download")
+        st.success("Download complete.")
 
 
-@st.cache_data
+def local_data_files(data_dir, files, pins):
+    # Zip members are extracted on first use into a size-capped local cache and
+    # pinned there until `pins` is closed, so eviction cannot remove them mid-query
+    if os.path.isdir(data_dir):
+        return files
+    with stage("extract_files", files=len(files)):
+        return pins.enter_context(open_data_files(data_dir, files))
+
+
+@st.cache_data(max_entries=256)
 def get_filtered_files(data_dir, start_date, end_date):
-    all_files = sorted(Path(data_dir).glob("*.nc"))
-    if data_dir == DAILY_DATA_DIR:
-        # return [str(file) for file in all_files if pd.to_datetime(start_date) <= pd.to_datetime(file.stem[-6:], format="%Y%m") <= pd.to_datetime(end_date)]
+    note(cache="miss")
+    return filter_period_files(list_data_files(data_dir), start_date, end_date)
 
-        start_year_month = start_date.strftime("%Y%m")
-        end_year_month = end_date.strftime("%Y%m")
 
-        return [
-            str(file) for file in all_files
-            if start_year_month <= file.stem[-6:] <= end_year_month
-        ]
-    else:
-        return [str(file) for file in all_files if start_date.year <= int(file.stem[-4:]) <= end_date.year]
+@st.cache_resource(max_entries=64)
+def load_time_catalog(data_dir, files):
+    note(cache="miss")
+    return TimeCatalog.from_files({data_dir: files})
+
+
+def filtered_data_files(data_dir, start_date, end_date):
+    with stage("list_files", cached=True) as record:
+        files = get_filtered_files(data_dir, start_date, end_date)
+        record["files"] = len(files)
+    return local_data_files(data_dir, files, run_pins)
+
+
+@st.cache_resource
+def open_sparse_store(data_dir, variable):
+    # Stores are built by the ingest step: python sparse_store.py <data_dir> <variables>
+    return SparseStore.open(data_dir, variable)
+
+
+def reduce_emission_data(filtered_files, variables, aggr):
+    with stage("reduce", variables=len(variables)) as record:
+        # Aggregate straight from the sparse store when every species has been ingested
+        data_dir = str(Path(source_files(filtered_files)[0]).parent)
+        stores = [open_sparse_store(data_dir, variable) for variable in variables]
+        if all(store is not None and store.covers(filtered_files) for store in stores):
+            record["source"] = "sparse_store"
+            grids = {}
+            for variable, store in zip(variables, stores):
+                grids[variable], lat, lon = store.reduce(filtered_files, aggr)
+            return grids, lat, lon
+
+        # Otherwise read from the rechunked stores if the archive has been converted
+        chunked = [ChunkedStore.open(filtered_files, variable) for variable in variables]
+        if all(store is not None for store in chunked):
+            record["source"] = "chunked_store"
+            grids = {}
+            for variable, store in zip(variables, chunked):
+                variable_grids, lat, lon = stream_reduce(store.slices(filtered_files), [variable], aggr)
+                grids[variable] = variable_grids[variable]
+            return grids, lat, lon
+
+        # Fold files and time chunks into running accumulators, so memory stays at
+        # a few grid slices. Catalog slices (file, start, stop) read only those steps.
+        record["source"] = "netcdf"
+        return stream_reduce(filtered_files, variables, aggr)
 
 
 # Load and process data
-@st.cache_data
-def process_emission_data(filtered_files, variable, resolution, aggr="sum"):
-    # Open the dataset and select the variable
-    ds = xr.open_mfdataset(filtered_files)[variable]
-
-    if aggr == "mean":
-        ds = ds.mean(dim="time")
-    elif aggr == "sum":
-        ds = ds.sum(dim="time")
-    elif aggr == "max":
-        ds = ds.max(dim="time")
-    elif aggr == "min":
-        ds = ds.min(dim="time")
-    else:
+@st.cache_data(max_entries=8)
+def build_hex_pyramid(filtered_files, variable, aggr="sum"):
+    note(cache="miss")
+    if aggr not in AGGREGATIONS:
         st.error("Invalid aggregation type. Please select one of 'sum', 'mean', 'max', or 'min'.")
         st.stop()
 
-    lat = ds['lat'].values
-    lon = ds['lon'].values
-    data = ds.values
+    grids, lat, lon = reduce_emission_data(filtered_files, [variable], aggr)
+
+    # Bin once into every resolution; the slider then only rolls the pyramid up
+    with stage("bin"):
+        return HexPyramid.from_grid(grids[variable], lat, lon)
+
+
+@cached_result
+def process_emission_data(filtered_files, variable, resolution, aggr="sum"):
+    with stage("hex_pyramid", cached=True):
+        pyramid = build_hex_pyramid(filtered_files, variable, aggr)
+    with stage("level"):
+        hex_ids, values = pyramid.level(resolution)
+
+    return hex_frame(hex_ids, values)
+
+
+@st.cache_resource(max_entries=2)
+def build_species_pyramid(filtered_files, variables, aggr="sum"):
+    note(cache="miss")
+    # One pass over the files reduces every requested species together
+    grids, lat, lon = reduce_emission_data(filtered_files, variables, aggr)
+
+    with stage("bin"):
+        return HexPyramid.from_grid(np.stack([grids[variable] for variable in variables]), lat, lon)
+
+
+@cached_result
+def species_table(filtered_files, variables, resolution, aggr="sum"):
+    # Columnar per-hex table: one column per species, NaN where a hex has no emissions
+    with stage("species_pyramid", cached=True):
+        pyramid = build_species_pyramid(filtered_files, variables, aggr)
+    with stage("level"):
+        hex_ids, values, _ = pyramid.table(resolution)
+
+    return pd.DataFrame(values.astype(np.float32), index=hex_ids, columns=list(variables))
+
+
+def species_emission_data(table, variable):
+    column = table[variable].dropna()
+    return hex_frame(column.index.to_numpy(), column.to_numpy())
+
+
+def ingest_mtime(path):
+    # Modification time of an ingest step's output directory, None until it
+    # exists. Rebuilds replace the directory, so caches keyed on it pick them up.
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def temporal_index_mtime(data_dir, variable):
+    return ingest_mtime(index_path(data_dir, variable))
+
+
+def load_temporal_index(data_dir, variable):
+    # Indexes are built by the ingest step: python temporal_index.py <data_dir> <variables>
+    return open_temporal_index(data_dir, variable, temporal_index_mtime(data_dir, variable))
+
+
+@st.cache_resource(max_entries=16)
+def open_temporal_index(data_dir, variable, mtime):
+    # `mtime` keys the cache, so an index built or rebuilt later is picked up
+    return None if mtime is None else TemporalIndex.load(index_path(data_dir, variable))
+
+
+def query_temporal_index(index, start, stop, resolution, aggr="sum"):
+    # Aggregate the window [start, stop) from the index and sum per hexagon
+    values = index.window(start, stop, aggr)
+    cells = grid_cells(index.lat, index.lon, resolution).ravel()[index.cells]
+    hex_ids, values = bin_to_hex(values, cells)
 
-    # Prepare lists to store results
-    hex_ids = []
-    values = []
+    return hex_frame(hex_ids, values)
 
-    # Iterate over the data array to aggregate into hexagons
-    for lat_idx in range(len(lat)):
-        for lon_idx in range(len(lon)):
-            value = data[lat_idx, lon_idx]
-            if value > 0:  # Only process positive values
-                hex_id = h3.latlng_to_cell(lat[lat_idx], lon[lon_idx], resolution)
-                hex_ids.append(hex_id)
-                values.append(value)
 
-    # Aggregate data by hex_id
-    hex_dict = defaultdict(float)
-    for hex_id, value in zip(hex_ids, values):
-        hex_dict[hex_id] += value
+@cached_result
+def temporal_index_data(data_dir, variable, mtime, start, stop, resolution, aggr="sum"):
+    # `mtime` keys the cache, so a rebuilt index is not answered from old results
+    return query_temporal_index(open_temporal_index(data_dir, variable, mtime), start, stop, resolution, aggr)
 
-    df = pd.DataFrame(hex_dict.items(), columns=["hex_id", "value"])
-    df['value'] = df['value'].astype(float).round(2)
+@st.cache_resource(ttl=300)
+def load_precomputed_manifest():
+    # Written by the batch step: python submission_folder/src/batch_precompute.py --variables ...
+    return Manifest()
 
-    return df
+
+@cached_result
+def precomputed_data(path, mtime):
+    # `mtime` keys the cache, so outputs rewritten by a later batch run are reloaded
+    return hex_frame(*read_output(path))
+
+
+def hex_cube_mtime(data_dir, variable, resolution):
+    return ingest_mtime(cube_path(data_dir, variable, resolution))
+
+
+def load_hex_cube(data_dir, variable, resolution):
+    # Cubes are built by the ingest step: python hex_regrid.py <data_dir> <resolution> <variables>
+    return open_hex_cube(data_dir, variable, resolution, hex_cube_mtime(data_dir, variable, resolution))
+
+
+@st.cache_resource(max_entries=32)
+def open_hex_cube(data_dir, variable, resolution, mtime):
+    # `mtime` keys the cache, so a cube built or rebuilt later is picked up
+    return None if mtime is None else HexCube.load(cube_path(data_dir, variable, resolution))
+
+
+@cached_result
+def hex_cube_data(data_dir, variable, mtime, start, stop, resolution):
+    # Sum the per-hexagon series of the window [start, stop); `mtime` keys the
+    # cache, so a rebuilt cube is not answered from old results
+    cube = open_hex_cube(data_dir, variable, resolution, mtime)
+    values = cube.window(start, stop, "sum")
+    positive = values > 0
+
+    return hex_frame(cube.hex_ids[positive], values[positive])
+
+
+def hex_series(data_dir, variables, hex_id, start, stop):
+    # Per-step values of one hexagon over [start, stop), one column per variable
+    # that has a cube at the hexagon's resolution
+    resolution = h3.get_resolution(hex_id)
+    columns = {}
+    for variable in variables:
+        cube = load_hex_cube(data_dir, variable, resolution)
+        if cube is None:
+            continue
+        s, e = cube.bounds(start, stop)
+        series = cube.series(h3.str_to_int(hex_id))
+        columns[variable] = pd.Series(0.0 if series is None else series[s:e], index=cube.times[s:e])
+    return pd.DataFrame(columns)
+
+
+def clicked_hex():
+    # Hexagon clicked on the map in the previous interaction, if any
+    if viewport_culling:
+        return (st.session_state.get("emission_map") or {}).get("clicked")
+    selection = (st.session_state.get("emission_deck") or {}).get("selection", {})
+    objects = selection.get("objects", {}).get("emissions", [])
+    return objects[0]["hex_id"] if objects else None
+
+
+@cached_result
+def service_data(url, data_type, variable, start, stop, resolution, aggr="sum"):
+    # Computed on the aggregation service: python aggregation_service.py
+    return AggregationClient(url).aggregate(data_type, variable, start, stop, resolution, aggr)
+
+
+@st.cache_resource(max_entries=16)
+def build_hex_index(emission_data):
+    # Centroid buckets of the computed hexagons, reused while the user pans and zooms
+    return HexIndex(emission_data["hex_id"])
+
+
+def view_bounds(view):
+    # Reported viewport plus a margin
+    if view.get("bounds"):
+        return pad_bounds(view["bounds"], VIEWPORT_MARGIN)
+    return viewport_bounds(view["viewState"], margin=VIEWPORT_MARGIN)
+
+
+def visible_emission_data(emission_data, view):
+    # Hexagons inside the reported viewport plus a margin. Frames are computed
+    # globally and only culled here, so panning reuses the cached frame instead
+    # of reducing the files again for every viewport.
+    return emission_data.iloc[build_hex_index(emission_data).query(view_bounds(view))]
+
+
+def lod_emission_data(emission_frame, view, max_hexes=MAX_HEXES_PER_FRAME):
+    # Finest resolution whose visible hexagons fit the budget. The area estimate
+    # gives an upper bound; sparse emissions often allow it as is, otherwise step
+    # coarser. Every level comes from the per-resolution result cache.
+    bounds = view_bounds(view)
+    for resolution in range(lod_resolution(bounds, max_hexes), 0, -1):
+        emission_data = emission_frame(resolution)
+        visible = emission_data.iloc[build_hex_index(emission_data).query(bounds)]
+        if len(visible) <= max_hexes:
+            break
+    else:
+        # Still over budget at the coarsest level: keep the strongest hexagons
+        visible = visible.nlargest(max_hexes, "value")
+    return resolution, emission_data, visible
+
+def timeline_frame(data_dir, variable, species, start, stop, resolution, aggr="sum", service_type=None):
+    # One timeline frame, the window [start, stop), computed through the same
+    # cached functions as the main view. Runs on prefetch threads: the Streamlit
+    # caches are process-wide, but nothing here may draw to the page.
+    # `service_type` is the data type to request from the aggregation service,
+    # None to compute here.
+    if aggr == "sum" and load_hex_cube(data_dir, variable, resolution) is not None:
+        return hex_cube_data(data_dir, variable, hex_cube_mtime(data_dir, variable, resolution), start, stop, resolution)
+    if load_temporal_index(data_dir, variable) is not None:
+        return temporal_index_data(data_dir, variable, temporal_index_mtime(data_dir, variable), start, stop, resolution, aggr)
+    if service_type is not None:
+        return service_data(SERVICE_URL, service_type, variable, start, stop, resolution, aggr)
+
+    with contextlib.ExitStack() as pins:
+        files = get_filtered_files(data_dir, start, stop - datetime.timedelta(days=1))
+        day_files = local_data_files(data_dir, files, pins)
+        filtered_files = load_time_catalog(data_dir, tuple(day_files)).select(data_dir, start, stop)
+        if not filtered_files:
+            return None
+        if species:
+            return species_emission_data(species_table(filtered_files, species, resolution, aggr), variable)
+        return process_emission_data(filtered_files, variable, resolution, aggr)
+
+
+def timeline_window(data_type, day):
+    # Time steps shown for a timeline day: the day itself, or for monthly data
+    # the month holding it
+    if data_type == "Monthly":
+        start = day.replace(day=1)
+        return start, (start + datetime.timedelta(days=32)).replace(day=1)
+    return day, day + datetime.timedelta(days=1)
+
+
+def next_timeline_day(data_type, day, start, end):
+    # First day of the frame after `day`, wrapping around [start, end]
+    stop = timeline_window(data_type, day)[1]
+    return stop if stop <= end else start
+
+
+def timeline_windows(data_type, day, start, end, n):
+    # Windows of the up to n frames playback shows after `day`, each once
+    windows = []
+    current = timeline_window(data_type, day)
+    for _ in range(n):
+        day = next_timeline_day(data_type, day, start, end)
+        window = timeline_window(data_type, day)
+        if window == current or window in windows:
+            break
+        windows.append(window)
+    return windows
 
 # st.title("Emission Data Visualization")
 st.sidebar.header("Filter Options")
@@ -94,12 +378,20 @@ data_dir = DAILY_DATA_DIR if data_type == "Daily" else MONTHLY_DATA_DIR
 
 screen_height = streamlit_js_eval(js_expressions='screen.height', key='SCR') or 1080
 
-emission_type = st.sidebar.selectbox("Emission Type", [
+EMISSION_TYPES = [
     'C', 'CO2', 'CO', 'CH4', 'NMOC_g', 'H2', 'NOx', 'N2O', 'PM2p5', 'TPC', 'OC', 'BC', 'SO2', 'NH3', 'C2H6', 'CH3OH',
     'C2H5OH', 'C3H8', 'C2H2', 'C2H4', 'C3H6', 'C5H8', 'C10H16', 'C7H8', 'C6H6', 'C8H10', 'Toluene_lump',
     'Higher_Alkenes', 'Higher_Alkanes', 'CH2O', 'C2H4O', 'C3H6O', 'C2H6S', 'HCN', 'HCOOH', 'CH3COOH',
     'MEK', 'CH3COCHO', 'HOCH2CHO'
-])
+]
+
+emission_type = st.sidebar.selectbox("Emission Type", EMISSION_TYPES)
+
+# Reduce several species in one pass so switching "Emission Type" is a column lookup
+preload_species = st.sidebar.checkbox("Reduce all emission types in one pass", value=False)
+if preload_species:
+    preloaded_types = st.sidebar.multiselect("Preloaded Emission Types", EMISSION_TYPES, default=EMISSION_TYPES)
+    species = tuple(v for v in EMISSION_TYPES if v in preloaded_types or v == emission_type)
 
 pick_start_date = st.sidebar.date_input("Start Date", value=pd.to_datetime("2022-01-01"))
 pick_end_date = st.sidebar.date_input("End Date", value=pd.to_datetime("2022-12-30"))
@@ -116,59 +408,229 @@ else:
     timeline = st.checkbox("Timeline changes", value=False)
 
 if timeline:
-    daily_date_range = st.slider("Select Date for Daily Data", start_date, end_date, start_date)
-    start_date_daily = daily_date_range
-    end_date_daily = daily_date_range + pd.Timedelta(days=1)
-
-resolution = st.sidebar.slider("H3 Resolution (Lower is Coarser)", min_value=1, max_value=5, value=4)
+    # Playback advances the day slider through session state before it is drawn
+    if "timeline_next" in st.session_state:
+        st.session_state["timeline_day"] = st.session_state.pop("timeline_next")
+    if not start_date <= st.session_state.get("timeline_day", start_date) <= end_date:
+        st.session_state["timeline_day"] = start_date
+    st.session_state.setdefault("timeline_day", start_date)
+
+    day_col, play_col, speed_col = st.columns([6, 1, 2])
+    with day_col:
+        daily_date_range = st.slider("Select Date for Daily Data", start_date, end_date, key="timeline_day")
+    with play_col:
+        playing = st.toggle("Play", key="timeline_playing")
+    with speed_col:
+        speed = st.select_slider("Speed (days per second)", options=[1, 2, 4, 8, 12], value=4)
+    # Monthly data shows the month holding the selected day
+    start_date_daily, end_date_daily = timeline_window(data_type, daily_date_range)
+
+# The custom map component reports its viewport, so only visible hexagons are sent
+viewport_culling = st.sidebar.checkbox("Only send hexagons in view", value=False)
+
+# Level of detail: pick the resolution from the zoom and viewport area
+auto_resolution = viewport_culling and st.sidebar.checkbox("Automatic resolution from zoom", value=True)
+
+resolution = st.sidebar.slider("H3 Resolution (Lower is Coarser)", min_value=1, max_value=5, value=4, disabled=auto_resolution)
 
 aggr = st.sidebar.radio("Aggregation Type", ["sum", "mean", "max", "min"])
 
+# Offload reduction and binning to the aggregation service when one is configured
+use_service = bool(SERVICE_URL) and st.sidebar.checkbox("Compute on the aggregation service", value=True)
+
+with st.sidebar.expander("Result cache"):
+    st.json(get_result_cache().stats())
+    st.json(get_prefetcher().stats(session_id))
+
+# Filled in once the run has finished, with the stages of this run
+show_timings = st.sidebar.checkbox("Show request timings", value=False)
+timings_panel = st.sidebar.empty()
+
+
+def show_trace(panel, trace):
+    # One row per stage, indented by nesting; counters include nested stages
+    stages = pd.DataFrame(trace.stages)
+    stages["stage"] = ["\u2003" * depth + name for depth, name in zip(stages.pop("depth"), stages["stage"])]
+    columns = ["stage", "seconds", "cache", "hexagons", "bytes_read", "payload_bytes", "read_seconds", "source", "files"]
+    with panel.container():
+        st.caption(f"Request {trace.request_id}: {trace.seconds:.3f} s")
+        st.dataframe(stages[[c for c in columns if c in stages]], hide_index=True, use_container_width=True)
+
 try:
-    # Get filtered files
+    temporal_index = load_temporal_index(data_dir, emission_type)
+
+    # Exact date windows for the hex cube and the temporal index
     if timeline:
-        filtered_files = get_filtered_files(data_dir, start_date_daily, end_date_daily)
+        window = (start_date_daily, end_date_daily)
     else:
-        filtered_files = get_filtered_files(data_dir, start_date, end_date)
+        window = (start_date, end_date + pd.Timedelta(days=1))
 
-    # st.write(f"Filtered files: {filtered_files}")
-    if not filtered_files:
-        st.error("No files found for the selected date range.")
-        st.stop()
-
-    # st.write(f"Found {len(filtered_files)} files for the selected date range.")
+    if temporal_index is None and not use_service:
+        # Get filtered files; the timeline reads exactly the selected day (or month)
+        if timeline:
+            day_files = filtered_data_files(data_dir, start_date_daily, end_date_daily - datetime.timedelta(days=1))
+            with stage("time_catalog", cached=True):
+                time_catalog = load_time_catalog(data_dir, tuple(day_files))
+                filtered_files = time_catalog.select(data_dir, start_date_daily, end_date_daily)
+        else:
+            filtered_files = filtered_data_files(data_dir, start_date, end_date)
 
-    # Process data
-    emission_data = process_emission_data(filtered_files, emission_type, resolution, aggr)
-
-    # Define the pydeck layer
-    layer = pdk.Layer(
-        "H3HexagonLayer",
-        data=emission_data,
-        pickable=True,
-        stroked=False,
-        filled=True,
-        get_hexagon="hex_id",
-        get_fill_color="[255, 255 - value, 0]",
-    )
+        # st.write(f"Filtered files: {filtered_files}")
+        if not filtered_files:
+            st.error("No files found for the selected date range.")
+            st.stop()
 
-    # Set the viewport location
-    view_state = pdk.ViewState(
-        latitude=0,
-        longitude=0,
-        zoom=2,
-        bearing=0,
-        pitch=0,
-    )
+        # st.write(f"Found {len(filtered_files)} files for the selected date range.")
 
-    # Render the deck.gl map
-    deck = pdk.Deck(
-        layers=[layer],
-        initial_view_state=view_state,
-        tooltip={"text": "Emission(grams): {value}"},
-    )
+    # Process data
+    def emission_frame(resolution):
+        with stage("emission_frame", resolution=resolution):
+            return compute_emission_frame(resolution)
+
+    def compute_emission_frame(resolution):
+        # A hex x time cube answers a window sum without touching the grid
+        if aggr == "sum" and load_hex_cube(data_dir, emission_type, resolution) is not None:
+            return hex_cube_data(
+                data_dir, emission_type, hex_cube_mtime(data_dir, emission_type, resolution), *window, resolution
+            )
+        if temporal_index is not None:
+            # Exact date windows in two lookups, without touching the NetCDF files
+            return temporal_index_data(
+                data_dir, emission_type, temporal_index_mtime(data_dir, emission_type), *window, resolution, aggr
+            )
+        if use_service:
+            # The service reads exactly the window, on its own worker processes
+            return service_data(SERVICE_URL, data_type, emission_type, *window, resolution, aggr)
+        if not timeline:
+            # Batch outputs for exactly these files are served as they are
+            path = load_precomputed_manifest().lookup(data_dir, emission_type, period_label(filtered_files), resolution, aggr)
+            if path is not None:
+                return precomputed_data(str(path), path.stat().st_mtime)
+        if preload_species:
+            table = species_table(filtered_files, species, resolution, aggr)
+            return species_emission_data(table, emission_type)
+        return process_emission_data(filtered_files, emission_type, resolution, aggr)
+
+    # A clicked hexagon gets its time series next to the map
+    clicked = clicked_hex()
+    if clicked:
+        map_area, series_area = st.columns([3, 1])
+    else:
+        map_area = st.container()
+
+    with map_area:
+        if viewport_culling:
+            # Latest view of the component, from the previous interaction
+            view = st.session_state.get("emission_map") or {}
+            if "viewState" not in view:
+                view = {"viewState": {"latitude": 0, "longitude": 0, "zoom": 2, "bearing": 0, "pitch": 0}}
+            if auto_resolution:
+                with stage("lod"):
+                    resolution, emission_data, visible = lod_emission_data(emission_frame, view)
+            else:
+                emission_data = emission_frame(resolution)
+                with stage("cull"):
+                    visible = visible_emission_data(emission_data, view)
+
+            with stage("render"):
+                map_component(visible, emission_type, view["viewState"], key="emission_map")
+            st.caption(f"Resolution {resolution}: {len(visible)} of {len(emission_data)} hexagons in view")
+        else:
+            emission_data = emission_frame(resolution)
+
+            # Define the pydeck layer; its JSON needs H3 strings
+            layer = pdk.Layer(
+                "H3HexagonLayer",
+                id="emissions",
+                data=display_frame(emission_data),
+                pickable=True,
+                stroked=False,
+                filled=True,
+                get_hexagon="hex_id",
+                get_fill_color="[255, 255 - value, 0]",
+            )
+
+            # Set the viewport location
+            view_state = pdk.ViewState(
+                latitude=0,
+                longitude=0,
+                zoom=2,
+                bearing=0,
+                pitch=0,
+            )
+
+            # Render the deck.gl map
+            deck = pdk.Deck(
+                layers=[layer],
+                initial_view_state=view_state,
+                tooltip={"text": "Emission(grams): {value}"},
+            )
+
+            # Serialising the deck dominates this path. st.pydeck_chart does it inside
+            # "render"; measuring it on its own costs a second serialisation, so that
+            # is only done while timings are shown.
+            if show_timings:
+                with stage("deck_json", hexagons=len(emission_data)) as record:
+                    record["payload_bytes"] = len(deck.to_json())
+
+            # Clicking a hexagon selects it for the time series panel
+            with stage("render"):
+                st.pydeck_chart(deck, use_container_width=True, on_select="rerun", selection_mode="single-object", key="emission_deck")
+
+    if clicked:
+        with series_area:
+            st.subheader(f"Hexagon {clicked}")
+            started = time.perf_counter()
+            variables = species if preload_species else (emission_type,)
+            with stage("series"):
+                series = hex_series(data_dir, variables, clicked, start_date, end_date + pd.Timedelta(days=1))
+            if series.empty:
+                st.info(
+                    f"No time series store at resolution {h3.get_resolution(clicked)}. Build one with "
+                    f"`python hex_regrid.py {data_dir} {h3.get_resolution(clicked)} {emission_type}`."
+                )
+            else:
+                st.line_chart(series)
+                st.caption(f"{len(series)} steps in {(time.perf_counter() - started) * 1000:.0f} ms")
 
-    st.pydeck_chart(deck, use_container_width=True)
+    if timeline:
+        # Compute the next frames while this one is shown; changing any parameter
+        # cancels the queued frames of the old one. Frames without files are skipped.
+        prefetch_species = species if preload_species else None
+        service_type = data_type if use_service else None
+        get_prefetcher().schedule(
+            session_id,
+            (data_dir, emission_type, prefetch_species, resolution, aggr, service_type),
+            [
+                (frame_start, partial(
+                    timeline_frame, data_dir, emission_type, prefetch_species, frame_start, frame_stop,
+                    resolution, aggr, service_type,
+                ))
+                for frame_start, frame_stop in timeline_windows(data_type, daily_date_range, start_date, end_date, PREFETCH_FRAMES)
+                if get_filtered_files(data_dir, frame_start, frame_stop - datetime.timedelta(days=1))
+            ],
+        )
+
+        if playing:
+            # Hold the frame for its share of a second, then step to the next day (or month)
+            last_tick = st.session_state.get("timeline_tick", 0.0)
+            time.sleep(max(0.0, 1 / speed - (time.monotonic() - last_tick)))
+            st.session_state["timeline_tick"] = time.monotonic()
+            st.session_state["timeline_next"] = next_timeline_day(data_type, daily_date_range, start_date, end_date)
+            st.rerun()
 
 except Exception as e:
+    trace.params["error"] = str(e)
     st.error(f"An error occurred: {e}")
+
+finally:
+    # Also runs when the script stops or reruns, e.g. on every playback step
+    trace.params.update(
+        data_type=data_type, emission_type=emission_type, start_date=start_date, end_date=end_date,
+        day=start_date_daily if timeline else None, resolution=resolution, aggr=aggr,
+        viewport_culling=viewport_culling, service=use_service,
+    )
+    run_pins.close()
+    get_metrics_log().write(trace.finish())
+    if show_timings:
+        show_trace(timings_panel, trace)
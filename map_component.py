@@ -1,7 +1,11 @@
 import os
+import h3
+import numpy as np
 import streamlit as st
 import streamlit.components.v1 as components
 
+from instrumentation import stage
+
 # Toggle dev vs. production mode
 _DEV_MODE = True
 
@@ -30,18 +34,173 @@ def declare_component():
 # This is our actual Streamlit component "object".
 _map_component = declare_component()
 
+# Send the whole frame instead of a delta once the delta would touch more than
+# this fraction of the new frame's hexagons
+RESYNC_FRACTION = 0.5
+
+# Mirrors of this many recent frames are kept, so a browser that fell behind
+# can still be sent a delta against the frame it holds
+HISTORY_FRAMES = 4
+
+
+def hex_columns(data):
+    """Return the 'hex_id' column as uint64 H3 indices and 'value' as float32, without copies for a `hex_frame`."""
+    hex_ids = data["hex_id"].to_numpy()
+    if hex_ids.dtype == object:
+        hex_ids = np.fromiter((h3.str_to_int(h) for h in hex_ids), dtype=np.uint64, count=len(hex_ids))
+    return hex_ids.astype(np.uint64, copy=False), data["value"].to_numpy(dtype=np.float32)
+
+
+def _colors(values):
+    # Same ramp as the pydeck layer: [255, 255 - value, 0]
+    colors = np.empty((len(values), 4), dtype=np.uint8)
+    colors[:, 0] = 255
+    colors[:, 1] = np.clip(255 - np.nan_to_num(values), 0, 255)
+    colors[:, 2] = 0
+    colors[:, 3] = 255
+    return colors
+
+
+def pack_columns(hex_ids, values):
+    """
+    Pack hexagon columns into the little-endian byte buffers the component reads.
+
+    :param hex_ids: uint64 H3 indices.
+    :param values: Values per hexagon.
+    :return: dict of bytes: 'hexIds' (uint64), 'values' (float32) and 'colors' (RGBA uint8).
+    """
+    values = np.asarray(values, dtype=np.float32)
+    return {
+        "hexIds": np.asarray(hex_ids, dtype="<u8").tobytes(),
+        "values": values.astype("<f4").tobytes(),
+        "colors": _colors(values).tobytes(),
+    }
+
+
+def frame_delta(old_ids, old_values, hex_ids, values):
+    """
+    Diff a new frame against the hexagons the browser holds.
+
+    The browser keeps its hexagons in arrays; a delta overwrites the values of
+    `changed` positions, drops the `removed` positions and appends the added
+    hexagons, in that order, which is the order of the returned mirror.
+
+    :param old_ids: uint64 H3 indices held by the browser, in its order.
+    :param old_values: float32 values held by the browser.
+    :param hex_ids: uint64 H3 indices of the new frame.
+    :param values: float32 values of the new frame.
+    :return: (removed positions, changed positions, changed values, added mask over the
+             new frame, mirror ids, mirror values).
+    """
+    order = np.argsort(old_ids, kind="stable")
+    pos = np.searchsorted(old_ids[order], hex_ids)
+    pos = np.minimum(pos, max(len(old_ids) - 1, 0))
+    found = np.zeros(len(hex_ids), dtype=bool)
+    if len(old_ids):
+        found = old_ids[order][pos] == hex_ids
+    old_pos = order[pos[found]] if len(old_ids) else np.empty(0, dtype=np.int64)
+
+    keep = np.zeros(len(old_ids), dtype=bool)
+    keep[old_pos] = True
+    differs = old_values[old_pos] != values[found]
+    # NaN never equals itself; NaN to NaN is not a change
+    differs &= ~(np.isnan(old_values[old_pos]) & np.isnan(values[found]))
+
+    mirror_values = old_values.copy()
+    mirror_values[old_pos] = values[found]
+    return (
+        np.flatnonzero(~keep).astype(np.uint32),
+        old_pos[differs].astype(np.uint32),
+        values[found][differs],
+        ~found,
+        np.concatenate([old_ids[keep], hex_ids[~found]]),
+        np.concatenate([mirror_values[keep], values[~found]]),
+    )
+
+
+def frame_update(state, hex_ids, values, base=None):
+    """
+    Build the component arguments that bring the browser from frame `base` to a new frame.
+
+    :param state: Mirror of the frames sent to the browser ({'frame', 'hexIds', 'values', 'frames'}),
+                  or None. 'frames' maps the last HISTORY_FRAMES frame numbers to their (ids, values).
+    :param hex_ids: uint64 H3 indices of the new frame.
+    :param values: float32 values of the new frame.
+    :param base: Frame the browser holds, to diff against; None, or a frame no longer in the
+                 history, sends the whole frame.
+    :return: (component arguments, new mirror state).
+    """
+    frame = state["frame"] + 1 if state else 0
+    frames = dict(state["frames"]) if state else {}
+    if base in frames:
+        base_ids, base_values = frames[base]
+        removed, changed, changed_values, added, mirror_ids, mirror_values = frame_delta(
+            base_ids, base_values, hex_ids, values
+        )
+        if base == state["frame"] and not len(removed) and not len(changed) and not added.any():
+            # Nothing to send; the browser ignores a frame it already shows
+            frame = state["frame"]
+        if len(removed) + len(changed) + added.sum() <= RESYNC_FRACTION * max(len(hex_ids), 1):
+            args = pack_columns(hex_ids[added], values[added])
+            args.update(
+                frame=frame,
+                baseFrame=base,
+                removed=removed.astype("<u4").tobytes(),
+                changed=changed.astype("<u4").tobytes(),
+                changedValues=changed_values.astype("<f4").tobytes(),
+                changedColors=_colors(changed_values).tobytes(),
+            )
+            return args, _mirror(frames, frame, mirror_ids, mirror_values)
+
+    # Full frame: the browser replaces whatever it holds
+    args = pack_columns(hex_ids, values)
+    args.update(frame=frame, baseFrame=None)
+    return args, _mirror(frames, frame, hex_ids, values)
+
+
+def _mirror(frames, frame, hex_ids, values):
+    frames[frame] = (hex_ids, values)
+    for old in sorted(frames)[:-HISTORY_FRAMES]:
+        del frames[old]
+    return {"frame": frame, "hexIds": hex_ids, "values": values, "frames": frames}
+
 def map_component(data, emission_type, initial_view_state, key=None):
     """
     Call the custom component. This function is what you'll import and invoke from your main Streamlit script.
 
-    :param data: List of dicts (e.g., rows from a DataFrame), each containing lat/lon plus emission values.
-    :param emission_type: The key in each dict that holds the emission data (e.g. "CO2").
+    :param data: DataFrame with 'hex_id' and 'value' columns; sent as packed binary columns, not JSON rows.
+                 With a `key`, only the hexagons added, removed or changed since the previous call are sent.
+    :param emission_type: Emission type named in the tooltip (e.g. "CO2").
     :param initial_view_state: dict with 'latitude', 'longitude', 'zoom', 'bearing', 'pitch'.
     :param key: A unique key for Streamlit's state management.
-    :return: The object returned by the JavaScript side (commonly {"viewState": {...}}).
+    :return: The object returned by the JavaScript side: {"viewState": {...}, "bounds": [min_lat, min_lon, max_lat, max_lon],
+             "clicked": H3 string or None} once the user has moved or clicked the map, {"viewState": initial_view_state}
+             before that.
     """
+    with stage("map_payload") as record:
+        hex_ids, values = hex_columns(data)
+        if key is None:
+            args = pack_columns(hex_ids, values)
+            args.update(frame=0, baseFrame=None)
+        else:
+            # Mirrors of the frames sent to the browser, to diff the next frame against
+            state_key = f"_map_component_{key}"
+            state = st.session_state.get(state_key)
+            value = st.session_state.get(key) or {}
+            request = value.get("resync")
+            base = state["frame"] if state else None
+            handled = state["resynced"] if state else request
+            if request is not None and request != handled:
+                # The browser could not apply a frame: diff against the one it reports holding
+                base, handled = value.get("applied"), request
+            args, state = frame_update(state, hex_ids, values, base)
+            state["resynced"] = handled
+            st.session_state[state_key] = state
+        record["hexagons"] = len(hex_ids)
+        record["payload_bytes"] = sum(len(arg) for arg in args.values() if isinstance(arg, bytes))
+
     return _map_component(
-        data=data,
+        **args,
         emissionType=emission_type,
         initialViewState=initial_view_state,
         key=key,
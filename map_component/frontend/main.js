@@ -1,15 +1,185 @@
 // main.js
 import { Streamlit } from "streamlit-component-lib";
-import { Deck } from '@deck.gl/core';
-import { ScatterplotLayer } from '@deck.gl/layers';
+import { Deck, WebMercatorViewport } from '@deck.gl/core';
+import { H3HexagonLayer } from '@deck.gl/geo-layers';
 
 // A reference to the Deck instance
 let deckInstance = null;
 
+// Pending view state report, sent once panning/zooming settles
+let reportTimer = null;
+
+// Hexagons on the map: {frame, hexIds, values, colors, length}
+let current = null;
+
+// Last value sent to Python
+let lastValue = {};
+
+/**
+ * Send the view state and its [minLat, minLon, maxLat, maxLon] bounds to Python,
+ * which uses them to compute and send only the hexagons in view.
+ */
+function reportViewState(viewState) {
+  clearTimeout(reportTimer);
+  reportTimer = setTimeout(() => {
+    const [minLon, minLat, maxLon, maxLat] = new WebMercatorViewport(viewState).getBounds();
+    lastValue = { ...lastValue, viewState, bounds: [minLat, minLon, maxLat, maxLon] };
+    Streamlit.setComponentValue(lastValue);
+  }, 250);
+}
+
+/**
+ * View a byte buffer from Python as a typed array, copying only if misaligned
+ */
+function typedView(bytes, ArrayType) {
+  if (bytes.byteOffset % ArrayType.BYTES_PER_ELEMENT !== 0) {
+    bytes = bytes.slice();
+  }
+  return new ArrayType(bytes.buffer, bytes.byteOffset, bytes.byteLength / ArrayType.BYTES_PER_ELEMENT);
+}
+
+/**
+ * Columns packed by map_component.pack_columns: uint64 H3 indices,
+ * float32 values and RGBA colors, one entry per hexagon
+ */
+function decodeColumns({ hexIds, values, colors }) {
+  const columns = {
+    hexIds: typedView(hexIds, BigUint64Array),
+    values: typedView(values, Float32Array),
+    colors: typedView(colors, Uint8Array),
+  };
+  columns.length = columns.values.length;
+  return columns;
+}
+
+/**
+ * H3 strings of the columns' hexagons, built once per frame
+ */
+function hexStrings(columns) {
+  if (!columns.hexStrings) {
+    columns.hexStrings = Array.from(columns.hexIds, (hexId) => hexId.toString(16));
+  }
+  return columns.hexStrings;
+}
+
+/**
+ * Send the clicked hexagon (an H3 string, or null off the hexagons) to Python
+ */
+function reportClick({ index, layer }) {
+  const clicked = layer && index >= 0 && current ? hexStrings(current)[index] : null;
+  lastValue = { ...lastValue, clicked };
+  Streamlit.setComponentValue(lastValue);
+}
+
+/**
+ * Apply a frame from map_component.frame_update to the hexagons on the map.
+ * A full frame (baseFrame null) replaces them; a delta overwrites changed
+ * positions, drops removed ones and appends added hexagons, mirroring the
+ * order Python keeps. Returns false when there is nothing new to draw.
+ */
+function applyFrame(args) {
+  const added = decodeColumns(args);
+  if (args.baseFrame === null || args.baseFrame === undefined) {
+    current = { ...added, frame: args.frame };
+    return true;
+  }
+  if (current && args.frame === current.frame) {
+    return false;
+  }
+  if (!current || args.baseFrame !== current.frame) {
+    // Our hexagons are not the base of this delta: report the frame we hold,
+    // which Python diffs the next frame against (or sends in full)
+    Streamlit.setComponentValue({ ...lastValue, resync: args.frame, applied: current ? current.frame : null });
+    return false;
+  }
+
+  const removed = typedView(args.removed, Uint32Array);
+  const changed = typedView(args.changed, Uint32Array);
+  const changedValues = typedView(args.changedValues, Float32Array);
+  const changedColors = typedView(args.changedColors, Uint8Array);
+
+  const values = current.values.slice();
+  const colors = current.colors.slice();
+  for (let k = 0; k < changed.length; k++) {
+    values[changed[k]] = changedValues[k];
+    colors.set(changedColors.subarray(k * 4, k * 4 + 4), changed[k] * 4);
+  }
+
+  const keep = new Uint8Array(current.length).fill(1);
+  for (let k = 0; k < removed.length; k++) {
+    keep[removed[k]] = 0;
+  }
+  const length = current.length - removed.length + added.length;
+  const next = {
+    frame: args.frame,
+    length,
+    hexIds: new BigUint64Array(length),
+    values: new Float32Array(length),
+    colors: new Uint8Array(length * 4),
+  };
+  // Kept hexagons keep their H3 strings; only added ones are converted
+  const strings = current.hexStrings && new Array(length);
+  let j = 0;
+  for (let i = 0; i < current.length; i++) {
+    if (keep[i]) {
+      next.hexIds[j] = current.hexIds[i];
+      next.values[j] = values[i];
+      next.colors.set(colors.subarray(i * 4, i * 4 + 4), j * 4);
+      if (strings) {
+        strings[j] = current.hexStrings[i];
+      }
+      j++;
+    }
+  }
+  if (strings) {
+    const addedStrings = hexStrings(added);
+    for (let k = 0; k < added.length; k++) {
+      strings[j + k] = addedStrings[k];
+    }
+    next.hexStrings = strings;
+  }
+  next.hexIds.set(added.hexIds, j);
+  next.values.set(added.values, j);
+  next.colors.set(added.colors, j * 4);
+  current = next;
+  return true;
+}
+
+/**
+ * Hexagon layer over the columns: the packed RGBA colors are a binary
+ * attribute, and hexagons are read from the frame's cached H3 strings
+ */
+function hexLayer(columns) {
+  const strings = hexStrings(columns);
+  return new H3HexagonLayer({
+    id: "emissions",
+    data: {
+      length: columns.length,
+      attributes: {
+        getFillColor: { value: columns.colors, size: 4 },
+      },
+    },
+    pickable: true,
+    stroked: false,
+    filled: true,
+    getHexagon: (_, { index }) => strings[index],
+    updateTriggers: {
+      getHexagon: strings,
+    },
+  });
+}
+
+/**
+ * Tooltip text for the picked hexagon
+ */
+function tooltip(columns, emissionType) {
+  return ({ index, layer }) => layer && index >= 0 && `${emissionType} emission(grams): ${columns.values[index].toFixed(2)}`;
+}
+
 /**
  * Create or update the deck instance
  */
-function renderDeckGL(initialViewState) {
+function renderDeckGL(initialViewState, columns, emissionType) {
   if (!deckInstance) {
     deckInstance = new Deck({
       container: "root",
@@ -17,23 +187,18 @@ function renderDeckGL(initialViewState) {
       controller: true,
       onViewStateChange: ({ viewState }) => {
         // Whenever the user pans/zooms/rotates, send updated viewState to Python
-        Streamlit.setComponentValue({ viewState });
+        reportViewState(viewState);
       },
-      layers: [
-        // Example layer with 2 points
-        new ScatterplotLayer({
-          data: [
-            { position: [-10, 25] },
-            { position: [10, 25] },
-          ],
-          getPosition: d => d.position,
-          getRadius: 1e6,
-          getColor: [255, 0, 0],
-        }),
-      ],
+      getTooltip: tooltip(columns, emissionType),
+      onClick: reportClick,
+      layers: [hexLayer(columns)],
     });
   } else {
-    deckInstance.setProps({ initialViewState });
+    // The map owns the view after the first render; only the hexagons change
+    deckInstance.setProps({
+      layers: [hexLayer(columns)],
+      getTooltip: tooltip(columns, emissionType),
+    });
   }
 }
 
@@ -41,8 +206,10 @@ function renderDeckGL(initialViewState) {
  * Fired each time Python re-renders the component (new data, new props, etc.).
  */
 function onRender(event) {
-  const { initialViewState } = event.detail;
-  renderDeckGL(initialViewState);
+  const { initialViewState, emissionType, ...frame } = event.detail.args;
+  if (applyFrame(frame) || !deckInstance) {
+    renderDeckGL(initialViewState, current || decodeColumns(frame), emissionType);
+  }
 }
 
 // Listen for re-render events from Streamlit
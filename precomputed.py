@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from time_catalog import file_period
+
+PRECOMPUTE_DIR = os.environ.get("PRECOMPUTE_DIR", "./cache/precomputed/")
+
+
+def period_label(files):
+    """Label of the period covered by `files` (in time order): '202201' or '202201-202212'."""
+    first, last = file_period(files[0]), file_period(files[-1])
+    return first if first == last else f"{first}-{last}"
+
+
+def output_key(data_dir, variable, period, resolution, aggr):
+    return f"{Path(data_dir).name}/{variable}/{aggr}/res{resolution}/{period}"
+
+
+def output_path(data_dir, variable, period, resolution, aggr, out_dir=PRECOMPUTE_DIR):
+    """Parquet file holding one precomputed hexagon aggregate."""
+    return Path(out_dir) / f"{output_key(data_dir, variable, period, resolution, aggr)}.parquet"
+
+
+def write_output(path, hex_ids, values):
+    """Write uint64 H3 indices and float32 values to Parquet, atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.table({
+        "hex_id": np.asarray(hex_ids, dtype=np.uint64),
+        "value": np.asarray(values, dtype=np.float32),
+    })
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_output(path):
+    """Return the (uint64 hex ids, float32 values) of an output written by `write_output`."""
+    table = pq.read_table(path)
+    return table["hex_id"].to_numpy(), table["value"].to_numpy()
+
+
+class Manifest:
+    """
+    Index of the precomputed outputs under `out_dir`, stored as manifest.json.
+
+    Every entry records its output file, row count and timings. A job is done
+    when its entry exists and its file is present, which is what makes batch
+    runs resumable.
+    """
+
+    def __init__(self, out_dir=PRECOMPUTE_DIR):
+        self.out_dir = Path(out_dir)
+        self.path = self.out_dir / "manifest.json"
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = json.load(f)["outputs"]
+        self._lock = threading.Lock()
+
+    def done(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and (self.out_dir / entry["path"]).exists()
+
+    def lookup(self, data_dir, variable, period, resolution, aggr):
+        """Return the path of a finished output, or None."""
+        key = output_key(data_dir, variable, period, resolution, aggr)
+        return self.out_dir / self.entries[key]["path"] if self.done(key) else None
+
+    def add(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+
+    def save(self):
+        """Write the manifest atomically, so an interrupted run never leaves it half written."""
+        with self._lock:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"manifest.json.{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"outputs": self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
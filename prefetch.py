@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "2"))
+
+
+class Prefetcher:
+    """
+    Speculative computation of upcoming frames on a small thread pool.
+
+    Jobs are expected to compute through the result cache, so a frame the app
+    asks for while its prefetch is still running is coalesced with it rather
+    than computed twice. Each session has its own parameters and queued
+    frames over the shared pool: scheduling for different parameters, or
+    without a frame that is still queued, cancels the work of that session
+    that has not started yet and leaves other sessions alone.
+    """
+
+    def __init__(self, max_workers=PREFETCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        # session id -> (params, {frame key: future})
+        self._sessions = {}
+        self.scheduled = 0
+        self.cancelled = 0
+
+    def schedule(self, session, params, jobs):
+        """
+        Queue `jobs` of `session` for `params`, dropping its queued work that
+        no longer applies.
+
+        Parameters:
+            session (str): Id of the session the frames are for.
+            params (tuple): Everything the frames depend on besides their
+                position (variable, resolution, aggregation, ...).
+            jobs (list): (frame key, callable) pairs, nearest frame first.
+        """
+        with self._lock:
+            # Forget sessions whose frames have all finished, e.g. closed tabs
+            for other, (_, futures) in list(self._sessions.items()):
+                if other != session and all(f.done() for f in futures.values()):
+                    del self._sessions[other]
+
+            old_params, futures = self._sessions.get(session, (None, {}))
+            wanted = {key for key, _ in jobs}
+            for key, future in list(futures.items()):
+                if params != old_params or key not in wanted:
+                    if future.cancel():
+                        self.cancelled += 1
+                    del futures[key]
+
+            for key, job in jobs:
+                if key not in futures:
+                    futures[key] = self._executor.submit(job)
+                    self.scheduled += 1
+            self._sessions[session] = (params, futures)
+
+    def stats(self, session=None):
+        """Counters of the frames of `session`, or of all sessions."""
+        with self._lock:
+            futures = [
+                f for other, (_, session_futures) in self._sessions.items()
+                if session is None or other == session
+                for f in session_futures.values()
+            ]
+        return {
+            "sessions": len(self._sessions),
+            "scheduled": self.scheduled,
+            "cancelled": self.cancelled,
+            "pending": sum(not f.running() and not f.done() for f in futures),
+            "running": sum(f.running() for f in futures),
+            "ready": sum(f.done() and not f.cancelled() and f.exception() is None for f in futures),
+            "failed": sum(f.done() and not f.cancelled() and f.exception() is not None for f in futures),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            for _, futures in self._sessions.values():
+                for future in futures.values():
+                    future.cancel()
+            self._sessions.clear()
+        self._executor.shutdown(wait=False)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Return the process-wide Prefetcher."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+        return _prefetcher
@@ -0,0 +1,231 @@
+import functools
+import hashlib
+from concurrent.futures import Future
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from instrumentation import stage
+
+CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(512 * 2**20)))
+SPILL_BYTES = int(os.environ.get("RESULT_CACHE_SPILL_BYTES", str(4 * 2**30)))
+SPILL_DIR = os.environ.get("RESULT_CACHE_DIR", "./cache/results/")
+
+
+def cache_key(*parts):
+    """Return a stable string key for hashable-by-repr arguments."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU cache of hex aggregate DataFrames with a disk tier.
+
+    Entries live in memory until the byte budget is exceeded. The least
+    recently used entries are then evicted and spilled to Parquet files in
+    `spill_dir`; a later hit reloads them into memory. The spill tier has its
+    own byte budget and drops its oldest files when that is exceeded.
+
+    Spill files go to a per-process subdirectory, so servers sharing
+    `spill_dir` never read each other's entries.
+
+    The cache is shared by every session of the process. `get_or_compute`
+    coalesces identical in-flight requests: the first caller computes and
+    the others wait on its future instead of repeating the work.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, spill_dir=SPILL_DIR, max_spill_bytes=SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) / str(os.getpid()) if spill_dir else None
+        self.max_spill_bytes = max_spill_bytes
+        self._entries = OrderedDict()
+        self._spilled = OrderedDict()
+        self._bytes = 0
+        self._spill_bytes = 0
+        self._inflight = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spill_hits = 0
+
+    def get(self, key):
+        """Return the cached DataFrame for `key`, or None on a miss."""
+        with self._lock:
+            df = self._lookup(key)
+            if df is None:
+                self.misses += 1
+            return df
+
+    def _lookup(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+        path = self._spilled.pop(key, None)
+        if path is None:
+            return None
+        self._spill_bytes -= path.stat().st_size
+        df = pd.read_parquet(path)
+        path.unlink()
+        self.spill_hits += 1
+        self._put(key, df)
+        return df
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the DataFrame for `key`, calling `compute()` at most once per key.
+
+        Waiters on an in-flight computation get its result or its error. If
+        the computing caller is interrupted by a script-control exception
+        (Streamlit's rerun or stop), that exception stays with its own session
+        and the waiters retry, one of them computing in its place.
+
+        Parameters:
+            key (str): Cache key, e.g. from `cache_key`.
+            compute (callable): Produces the DataFrame on a miss.
+
+        Returns:
+            pandas.DataFrame: The cached or computed result.
+        """
+        while True:
+            with self._lock:
+                df = self._lookup(key)
+                if df is not None:
+                    return df
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    self.misses += 1
+                    future = self._inflight[key] = Future()
+                else:
+                    self.coalesced += 1
+
+            if owner:
+                break
+            df = future.result()
+            if df is not None:
+                return df
+
+        try:
+            df = compute()
+        except Exception as e:
+            self._done(key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Abandoned: a rerun or stop of the owner's session must not reach other sessions
+            self._done(key)
+            future.set_result(None)
+            raise
+        self.put(key, df)
+        self._done(key)
+        future.set_result(df)
+        return df
+
+    def _done(self, key):
+        # Forget the in-flight entry before waking waiters, so retries start a new one
+        with self._lock:
+            del self._inflight[key]
+
+    def put(self, key, df):
+        with self._lock:
+            self._put(key, df)
+
+    def _put(self, key, df):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        size = frame_bytes(df)
+        self._entries[key] = (df, size)
+        self._bytes += size
+        # Always keep the newest entry, even when it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, (old_df, old_size) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            self.evictions += 1
+            self._spill(old_key, old_df)
+
+    def _spill(self, key, df):
+        if self.spill_dir is None:
+            return
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / f"{key}.parquet"
+        df.to_parquet(path)
+        self._spilled[key] = path
+        self._spill_bytes += path.stat().st_size
+        while self._spill_bytes > self.max_spill_bytes and self._spilled:
+            _, old_path = self._spilled.popitem(last=False)
+            self._spill_bytes -= old_path.stat().st_size
+            old_path.unlink()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current sizes."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "spilled_entries": len(self._spilled),
+                "spilled_bytes": self._spill_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            for path in self._spilled.values():
+                path.unlink(missing_ok=True)
+            self._spilled.clear()
+            self._spill_bytes = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide ResultCache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
+
+
+def cached_result(func):
+    """
+    Cache a function returning a DataFrame in the process-wide ResultCache.
+
+    Concurrent calls with the same arguments, from any session, share a
+    single computation. Each call is a stage of the current request trace,
+    marked as a cache hit or miss.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = cache_key(func.__module__, func.__qualname__, args, sorted(kwargs.items()))
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return func(*args, **kwargs)
+
+        with stage(func.__name__) as record:
+            df = get_result_cache().get_or_compute(key, compute)
+            record["cache"] = "miss" if computed else "hit"
+            record["hexagons"] = len(df)
+        return df
+    return wrapper
@@ -0,0 +1,181 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from dataset_pool import get_pool
+from hex_binning import AGGREGATIONS
+from instrumentation import count
+
+STORE_DIR = os.environ.get("SPARSE_STORE_DIR", "./cache/sparse/")
+
+
+def store_path(data_dir, variable, cache_dir=STORE_DIR):
+    """Directory holding the sparse store of `variable` for the files in `data_dir`."""
+    return Path(cache_dir) / Path(data_dir).name / variable
+
+
+def ingest_file(file, variable, out_dir, steps=8, pool=None):
+    """
+    Convert one NetCDF file to its sparse form.
+
+    Every time step keeps only its nonzero cells (NaNs included, so they are
+    not mistaken for zeros) in CSR layout: `indptr[t]:indptr[t + 1]` selects
+    the flat cell indices and values of step `t`.
+
+    Parameters:
+        file (str): NetCDF file path.
+        variable (str): Emission type.
+        out_dir (Path): Store directory; the member is a directory of `.npy`
+            arrays named after the file, so readers can memory-map them.
+        steps (int): Time steps read per chunk.
+        pool (DatasetPool): Pool to read from; the process-wide pool by default.
+
+    Returns:
+        pathlib.Path: Path of the written member.
+    """
+    pool = pool or get_pool()
+    da = pool.get(file)[variable]
+    n_steps = da.sizes["time"]
+
+    indptr, cells, values = [0], [], []
+    for t in range(0, n_steps, steps):
+        block = da.isel(time=slice(t, t + steps)).values
+        block = block.reshape(block.shape[0], -1)
+        rows, cols = np.nonzero(block != 0)
+        cells.append(cols.astype(np.int32))
+        values.append(block[rows, cols])
+        indptr.extend(indptr[-1] + np.cumsum(np.bincount(rows, minlength=block.shape[0])))
+
+    path = Path(out_dir) / Path(file).stem
+    # Written aside and moved into place, so readers never see half a member
+    tmp = path.with_name(f"{path.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "times.npy", pool.coords(file)["time"])
+    np.save(tmp / "indptr.npy", np.asarray(indptr, dtype=np.int64))
+    np.save(tmp / "cells.npy", np.concatenate(cells))
+    np.save(tmp / "values.npy", np.concatenate(values))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def source_files(filtered_files):
+    """Source file paths of `filtered_files`, which may be `(file, start, stop)` catalog slices."""
+    return [entry[0] if isinstance(entry, tuple) else entry for entry in filtered_files]
+
+
+def ingest(data_dir, variables, cache_dir=STORE_DIR):
+    """Convert every `.nc` file of `data_dir` for each of `variables`."""
+    files = sorted(Path(data_dir).glob("*.nc"))
+    coords = get_pool().coords(files[0])
+    for variable in variables:
+        out_dir = store_path(data_dir, variable, cache_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        np.savez(out_dir / "grid.npz", lat=coords["lat"], lon=coords["lon"])
+        for file in files:
+            ingest_file(file, variable, out_dir)
+
+
+class SparseStore:
+    """
+    Reader for the sparse store of one variable.
+
+    Aggregates are computed straight from the nonzero entries: cells absent
+    from a step are zeros, which only matter for the step count of 'mean' and
+    for 'max'/'min' of cells that are zero at least once.
+
+    Members are memory-mapped, so reducing a few steps of a file reads only
+    their `indptr` range of cells and values, and one store serves every
+    query on its data directory.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with np.load(self.path / "grid.npz") as grid:
+            self.lat = grid["lat"]
+            self.lon = grid["lon"]
+        self._members = {}
+
+    @classmethod
+    def open(cls, data_dir, variable, cache_dir=STORE_DIR):
+        """Return the store of `variable` for `data_dir`, or None if it has not been ingested."""
+        path = store_path(data_dir, variable, cache_dir)
+        if not (path / "grid.npz").exists():
+            return None
+        return cls(path)
+
+    def covers(self, filtered_files):
+        """Whether every file of `filtered_files` has been ingested."""
+        return all((self.path / Path(file).stem).is_dir() for file in source_files(filtered_files))
+
+    def member(self, file):
+        stem = Path(file).stem
+        member = self._members.get(stem)
+        if member is None:
+            member = {
+                name: np.load(self.path / stem / f"{name}.npy", mmap_mode="r")
+                for name in ("times", "indptr", "cells", "values")
+            }
+            self._members[stem] = member
+        return member
+
+    def reduce(self, filtered_files, aggr):
+        """
+        Reduce the store over the time steps of `filtered_files`.
+
+        Parameters:
+            filtered_files (list): Source file paths, or `(file, start, stop)` catalog slices.
+            aggr (str): Aggregation type ('sum', 'mean', 'max', 'min').
+
+        Returns:
+            tuple: (2-D grid, lat, lon), matching a dense time reduction.
+        """
+        if aggr not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation type: {aggr}")
+        n_cells = len(self.lat) * len(self.lon)
+        total = np.zeros(n_cells)
+        stored = np.zeros(n_cells, dtype=np.int64)
+        nans = np.zeros(n_cells, dtype=np.int64)
+        extreme = np.full(n_cells, np.nan)
+        ufunc = np.fmax if aggr == "max" else np.fmin
+        n_steps = 0
+
+        for entry in filtered_files:
+            file, start, stop = entry if isinstance(entry, tuple) else (entry, 0, None)
+            member = self.member(file)
+            stop = len(member["times"]) if stop is None else stop
+            lo, hi = member["indptr"][start], member["indptr"][stop]
+            cells, values = member["cells"][lo:hi], member["values"][lo:hi]
+            count(bytes_read=cells.nbytes + values.nbytes)
+            n_steps += stop - start
+
+            is_nan = np.isnan(values)
+            stored += np.bincount(cells, minlength=n_cells)
+            nans += np.bincount(cells[is_nan], minlength=n_cells)
+            if aggr in ("sum", "mean"):
+                total += np.bincount(cells, weights=np.where(is_nan, 0, values), minlength=n_cells)
+            else:
+                ufunc.at(extreme, cells, values)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if aggr == "sum":
+                grid = total
+            elif aggr == "mean":
+                valid = n_steps - nans
+                grid = np.where(valid > 0, total / valid, np.nan)
+            else:
+                # Cells missing from some step were zero there
+                grid = np.where(stored < n_steps, ufunc(extreme, 0), extreme)
+        return grid.reshape(len(self.lat), len(self.lon)), self.lat, self.lon
+
+
+if __name__ == "__main__":
+    # Ingest step, run once per data directory and variable:
+    #   python sparse_store.py ./GFED5/daily C CO2 CH4
+    ingest(sys.argv[1], sys.argv[2:])
+    for variable in sys.argv[2:]:
+        print(store_path(sys.argv[1], variable))
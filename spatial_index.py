@@ -0,0 +1,190 @@
+import math
+
+import h3
+import numpy as np
+
+from hex_lookup import RESOLUTIONS
+
+# deck.gl's web-mercator world is 512 pixels wide at zoom 0
+TILE_SIZE = 512
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def viewport_bounds(view_state, width=1280, height=720, margin=0.0):
+    """
+    Return the (min_lat, min_lon, max_lat, max_lon) box seen by a deck.gl map view.
+
+    Parameters:
+        view_state (dict): deck.gl viewState with 'latitude', 'longitude' and
+            'zoom', plus 'width'/'height' in pixels when known.
+        width (int): Fallback viewport width in pixels.
+        height (int): Fallback viewport height in pixels.
+        margin (float): Extra fraction of the span added on every side.
+
+    Returns:
+        tuple: The bounding box in degrees; longitudes may extend past ±180.
+    """
+    scale = TILE_SIZE * 2 ** view_state["zoom"]
+    width = view_state.get("width") or width
+    height = view_state.get("height") or height
+
+    # Project the center to web-mercator pixels, step half a screen each way, unproject
+    x = (view_state["longitude"] + 180) / 360 * scale
+    lat = math.radians(view_state["latitude"])
+    y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * scale
+    half_w, half_h = width / 2 * (1 + 2 * margin), height / 2 * (1 + 2 * margin)
+
+    def unproject_lat(py):
+        py = min(max(py, 0), scale)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * py / scale))))
+
+    min_lon = (x - half_w) / scale * 360 - 180
+    max_lon = (x + half_w) / scale * 360 - 180
+    return unproject_lat(y + half_h), min_lon, unproject_lat(y - half_h), max_lon
+
+
+def _axis_window(coord, lo, hi):
+    # Positions of lo <= coord <= hi in a monotonic coordinate, by binary search
+    if len(coord) > 1 and coord[0] > coord[-1]:
+        n = len(coord)
+        start = n - np.searchsorted(coord[::-1], hi, side="right")
+        stop = n - np.searchsorted(coord[::-1], lo, side="left")
+    else:
+        start = np.searchsorted(coord, lo, side="left")
+        stop = np.searchsorted(coord, hi, side="right")
+    return slice(int(start), int(max(start, stop)))
+
+
+def grid_window(lat, lon, bounds):
+    """
+    Return the (rows, cols) positions of a regular grid covering a bounding box.
+
+    Longitudes past ±180 wrap around the antimeridian: a box that crosses it
+    covers two column windows, which come back as one positional index array
+    in order from `min_lon`, so that `grid[rows, cols]` and `isel(lon=cols)` still
+    read the whole box.
+
+    Parameters:
+        lat (numpy.ndarray): Latitudes, ascending or descending.
+        lon (numpy.ndarray): Longitudes, ascending or descending.
+        bounds (tuple): (min_lat, min_lon, max_lat, max_lon).
+
+    Returns:
+        tuple: A row slice and a column slice or index array; both empty if
+            the box misses the grid.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds
+    rows = _axis_window(lat, min_lat, max_lat)
+    if max_lon - min_lon >= 360:
+        windows = [slice(0, len(lon))]
+    else:
+        windows = [_axis_window(lon, min_lon + shift, max_lon + shift) for shift in (360, 0, -360)]
+        windows = [w for w in windows if w.start < w.stop]
+    if rows.start == rows.stop or not windows:
+        return slice(0, 0), slice(0, 0)
+    if len(windows) == 1:
+        return rows, windows[0]
+    return rows, np.concatenate([np.arange(w.start, w.stop) for w in windows])
+
+
+def pad_bounds(bounds, margin):
+    """Grow a (min_lat, min_lon, max_lat, max_lon) box by `margin` of its span on every side."""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    d_lat, d_lon = (max_lat - min_lat) * margin, (max_lon - min_lon) * margin
+    return max(min_lat - d_lat, -90), min_lon - d_lon, min(max_lat + d_lat, 90), max_lon + d_lon
+
+
+def bounds_area_km2(bounds):
+    """Surface area of a (min_lat, min_lon, max_lat, max_lon) box on the sphere."""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    d_lon = math.radians(min(max_lon - min_lon, 360))
+    band = math.sin(math.radians(max_lat)) - math.sin(math.radians(min_lat))
+    return EARTH_RADIUS_KM ** 2 * d_lon * band
+
+
+def lod_resolution(bounds, max_hexes, resolutions=RESOLUTIONS):
+    """
+    Pick the finest H3 resolution that tiles a box with at most `max_hexes` hexagons.
+
+    Parameters:
+        bounds (tuple): (min_lat, min_lon, max_lat, max_lon) of the viewport.
+        max_hexes (int): Hexagon budget per frame.
+        resolutions (tuple): Candidate resolutions.
+
+    Returns:
+        int: The chosen resolution; the coarsest one if none fits.
+    """
+    area = bounds_area_km2(bounds)
+    for resolution in sorted(resolutions, reverse=True):
+        if area / h3.average_hexagon_area(resolution, unit="km^2") <= max_hexes:
+            return resolution
+    return min(resolutions)
+
+
+class HexIndex:
+    """
+    Bucket index over the centroids of a fixed set of uint64 H3 hexagons.
+
+    Centroids are sorted by 1-degree (lat, lon) bucket, so a box query only
+    touches the buckets it overlaps and costs in proportion to what is
+    visible rather than to the whole set.
+    """
+
+    def __init__(self, hex_ids, bucket_deg=1.0):
+        hex_ids = np.asarray(hex_ids, dtype=np.uint64).tolist()
+        centroids = np.array([h3.api.basic_int.cell_to_latlng(h) for h in hex_ids]).reshape(-1, 2)
+        self.bucket_deg = bucket_deg
+        self.n_lon = int(math.ceil(360 / bucket_deg))
+        keys = self._keys(centroids[:, 0], centroids[:, 1])
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        # Hexagons whose centroid is just outside the box can still overlap it;
+        # the pad is in degrees of latitude
+        self.pad = 0.0
+        if hex_ids:
+            edge_km = h3.average_hexagon_edge_length(h3.api.basic_int.get_resolution(hex_ids[0]), unit="km")
+            self.pad = 2 * edge_km / 111.0
+
+    def _keys(self, lat, lon):
+        rows = np.floor((np.asarray(lat) + 90) / self.bucket_deg).astype(np.int64)
+        cols = np.floor((np.asarray(lon) + 180) / self.bucket_deg).astype(np.int64) % self.n_lon
+        return rows * self.n_lon + cols
+
+    def query(self, bounds):
+        """
+        Return the positions (into the original hex list) of hexagons in a box.
+
+        Parameters:
+            bounds (tuple): (min_lat, min_lon, max_lat, max_lon); longitudes may
+                extend past ±180 across the antimeridian.
+
+        Returns:
+            numpy.ndarray: Sorted integer positions.
+        """
+        min_lat, min_lon, max_lat, max_lon = bounds
+        min_lat, max_lat = max(min_lat - self.pad, -90), min(max_lat + self.pad, 90)
+        # A degree of longitude shrinks with latitude, so widen the pad for the
+        # box's highest latitude; near the poles that covers every longitude
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        lon_pad = self.pad / cos_lat if cos_lat > 1e-9 else 360.0
+        min_lon, max_lon = min_lon - lon_pad, max_lon + lon_pad
+
+        row_lo = int((min_lat + 90) // self.bucket_deg)
+        row_hi = int(min((max_lat + 90) // self.bucket_deg, 180 / self.bucket_deg - 1))
+        if max_lon - min_lon >= 360 - self.bucket_deg:
+            col_ranges = [(0, self.n_lon - 1)]
+        else:
+            col_lo = int((min_lon + 180) // self.bucket_deg) % self.n_lon
+            col_hi = int((max_lon + 180) // self.bucket_deg) % self.n_lon
+            col_ranges = [(col_lo, col_hi)] if col_lo <= col_hi else [(col_lo, self.n_lon - 1), (0, col_hi)]
+
+        parts = []
+        for row in range(row_lo, row_hi + 1):
+            for col_lo, col_hi in col_ranges:
+                lo = np.searchsorted(self.keys, row * self.n_lon + col_lo, side="left")
+                hi = np.searchsorted(self.keys, row * self.n_lon + col_hi, side="right")
+                parts.append(self.order[lo:hi])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
@@ -0,0 +1,103 @@
+import os
+import time
+
+import numpy as np
+
+from dataset_pool import get_pool
+from hex_binning import AGGREGATIONS
+from instrumentation import count
+from spatial_index import grid_window
+
+# Upper bound on the raw data read per chunk, across all variables
+CHUNK_BYTES = int(os.environ.get("STREAM_CHUNK_BYTES", str(64 * 2**20)))
+
+
+class StreamingReducer:
+    """
+    Running time reduction of a grid, fed one block of time steps at a time.
+
+    Only the accumulators needed for `aggr` are kept: sum and non-NaN count
+    for 'sum'/'mean', a running max or min otherwise. NaNs are skipped like
+    xarray's default `skipna=True`.
+    """
+
+    def __init__(self, shape, aggr):
+        if aggr not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation type: {aggr}")
+        self.aggr = aggr
+        self.count = np.zeros(shape, dtype=np.int64)
+        if aggr in ("sum", "mean"):
+            self.acc = np.zeros(shape, dtype=np.float64)
+        else:
+            self.acc = np.full(shape, np.nan)
+
+    def update(self, block):
+        """Fold a (time, lat, lon) block into the accumulators."""
+        self.count += np.count_nonzero(~np.isnan(block), axis=0)
+        if self.aggr in ("sum", "mean"):
+            self.acc += np.nansum(block, axis=0, dtype=np.float64)
+        elif self.aggr == "max":
+            np.fmax(self.acc, np.fmax.reduce(block, axis=0), out=self.acc)
+        else:
+            np.fmin(self.acc, np.fmin.reduce(block, axis=0), out=self.acc)
+
+    def result(self):
+        """Return the reduced grid; NaN where no data was seen (0 for 'sum')."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if self.aggr == "sum":
+                return self.acc.copy()
+            if self.aggr == "mean":
+                return np.where(self.count > 0, self.acc / self.count, np.nan)
+            return np.where(self.count > 0, self.acc, np.nan)
+
+
+def stream_reduce(filtered_files, variables, aggr, bbox=None, chunk_bytes=CHUNK_BYTES, pool=None):
+    """
+    Reduce `variables` over time by walking files and time chunks in order.
+
+    Peak memory is the accumulators plus one chunk of at most `chunk_bytes`
+    (but never less than one time step), whatever the length of the range.
+
+    Parameters:
+        filtered_files (list): File paths, or `(file, start, stop)` catalog slices.
+        variables (list): Emission types to reduce together.
+        aggr (str): Aggregation type ('sum', 'mean', 'max', 'min').
+        bbox (tuple): Optional (min_lat, min_lon, max_lat, max_lon) to read only
+            that part of the grid.
+        chunk_bytes (int): Read budget per chunk.
+        pool (DatasetPool): Pool to read from; the process-wide pool by default.
+
+    Returns:
+        tuple: (dict of 2-D grids per variable, lat, lon) for the covered grid.
+    """
+    pool = pool or get_pool()
+    variables = list(variables)
+
+    first = filtered_files[0][0] if isinstance(filtered_files[0], tuple) else filtered_files[0]
+    coords = pool.coords(first)
+    rows, cols = slice(None), slice(None)
+    if bbox is not None:
+        rows, cols = grid_window(coords["lat"], coords["lon"], bbox)
+    lat, lon = coords["lat"][rows], coords["lon"][cols]
+
+    reducers = {variable: StreamingReducer((len(lat), len(lon)), aggr) for variable in variables}
+    step_bytes = max(1, len(lat) * len(lon) * 4 * len(variables))
+    steps = max(1, chunk_bytes // step_bytes)
+
+    for entry in filtered_files:
+        file, start, stop = entry if isinstance(entry, tuple) else (entry, 0, None)
+        ds = pool.get(file)
+        stop = ds.sizes["time"] if stop is None else stop
+        # Read whole on-disk time chunks where the budget allows
+        file_steps = steps
+        chunksizes = ds[variables[0]].encoding.get("chunksizes")
+        if chunksizes and steps >= chunksizes[0]:
+            file_steps = steps - steps % chunksizes[0]
+        for t in range(start, stop, file_steps):
+            read = time.perf_counter()
+            chunk = ds[variables].isel(time=slice(t, min(t + file_steps, stop)), lat=rows, lon=cols).load()
+            count(bytes_read=chunk.nbytes, read_seconds=time.perf_counter() - read)
+            for variable in variables:
+                reducers[variable].update(chunk[variable].values)
+
+    return {variable: reducer.result() for variable, reducer in reducers.items()}, lat, lon
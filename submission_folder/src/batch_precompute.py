@@ -0,0 +1,134 @@
+"""
+Precompute hexagon aggregates for the app, headless.
+
+Fans out over variable x period x aggregation on a process pool; each job
+reduces its files once and bins the result at every requested resolution.
+Outputs are Parquet files of uint64 H3 indices and float32 values, indexed
+by a manifest with per-output timings. Outputs already in the manifest are
+skipped, so an interrupted run picks up where it stopped.
+
+    python submission_folder/src/batch_precompute.py --data-type Daily \\
+        --variables C CO2 --resolutions 3 4 5 --aggr sum mean --span file year
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from process_data import DAILY_DATA_DIR, MONTHLY_DATA_DIR, bin_grid
+from hex_binning import AGGREGATIONS
+from hex_lookup import RESOLUTIONS
+from precomputed import PRECOMPUTE_DIR, Manifest, output_key, output_path, period_label, write_output
+from streaming import stream_reduce
+from time_catalog import file_period
+
+
+def periods(data_dir, span, start=None, end=None):
+    """
+    Group the files of `data_dir` into periods.
+
+    Parameters:
+        data_dir (str): Directory of NetCDF files.
+        span (str): 'file' for one period per file (a month of daily data, a
+            year of monthly data) or 'year' for calendar years.
+        start (str): First period to include, as YYYY or YYYYMM.
+        end (str): Last period to include, as YYYY or YYYYMM.
+
+    Returns:
+        list: (label, files) pairs in time order.
+    """
+    groups = defaultdict(list)
+    for file in sorted(Path(data_dir).glob("*.nc")):
+        period = file_period(file)
+        if start and period[:len(start)] < start or end and period[:len(end)] > end:
+            continue
+        groups[period if span == "file" else period[:4]].append(str(file))
+    return [(period_label(files), files) for _, files in sorted(groups.items())]
+
+
+def run_job(data_dir, files, variable, aggr, resolutions, out_dir):
+    """Reduce `files` once and write one output per resolution; returns the manifest entries."""
+    started = time.perf_counter()
+    grids, lat, lon = stream_reduce(files, [variable], aggr)
+    reduce_seconds = time.perf_counter() - started
+
+    entries = {}
+    label = period_label(files)
+    for resolution in resolutions:
+        binned = time.perf_counter()
+        hex_ids, values = bin_grid(grids[variable], lat, lon, resolution)
+        path = output_path(data_dir, variable, label, resolution, aggr, out_dir)
+        write_output(path, hex_ids, values)
+        entries[output_key(data_dir, variable, label, resolution, aggr)] = {
+            "path": str(path.relative_to(out_dir)),
+            "files": [Path(file).name for file in files],
+            "rows": len(hex_ids),
+            "reduce_seconds": round(reduce_seconds, 3),
+            "bin_seconds": round(time.perf_counter() - binned, 3),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--data-type", choices=["Daily", "Monthly"], default="Monthly")
+    parser.add_argument("--variables", nargs="+", required=True)
+    parser.add_argument("--resolutions", nargs="+", type=int, default=list(RESOLUTIONS))
+    parser.add_argument("--aggr", nargs="+", choices=AGGREGATIONS, default=["sum"])
+    parser.add_argument("--span", nargs="+", choices=["file", "year"], default=["file"])
+    parser.add_argument("--start", help="first period, YYYY or YYYYMM")
+    parser.add_argument("--end", help="last period, YYYY or YYYYMM")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", default=PRECOMPUTE_DIR)
+    args = parser.parse_args(argv)
+
+    data_dir = DAILY_DATA_DIR if args.data_type == "Daily" else MONTHLY_DATA_DIR
+    out_dir = Path(args.out)
+    manifest = Manifest(out_dir)
+
+    # One job per variable x period x aggregation, with the resolutions it still lacks.
+    # Spans can yield the same period (a file of monthly data is a year), which is
+    # queued once so no two jobs write the same output.
+    jobs, queued = [], set()
+    for span in args.span:
+        for label, files in periods(data_dir, span, args.start, args.end):
+            for variable in args.variables:
+                for aggr in args.aggr:
+                    keys = {
+                        resolution: output_key(data_dir, variable, label, resolution, aggr)
+                        for resolution in args.resolutions
+                    }
+                    missing = [
+                        resolution for resolution, key in keys.items()
+                        if key not in queued and not manifest.done(key)
+                    ]
+                    if missing:
+                        queued.update(keys[resolution] for resolution in missing)
+                        jobs.append((data_dir, files, variable, aggr, missing, out_dir))
+    print(f"{len(jobs)} jobs to run, {len(manifest.entries)} outputs already in {manifest.path}")
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run_job, *job): job for job in jobs}
+        for future in as_completed(futures):
+            _, files, variable, aggr, _, _ = futures[future]
+            try:
+                entries = future.result()
+            except Exception as e:
+                print(f"FAILED {variable} {period_label(files)} {aggr}: {e}", file=sys.stderr)
+                continue
+            for key, entry in entries.items():
+                manifest.add(key, entry)
+                print(f"{key}: {entry['rows']} hexagons, reduce {entry['reduce_seconds']}s, bin {entry['bin_seconds']}s")
+            # Record progress after every job so an interrupted run can resume
+            manifest.save()
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
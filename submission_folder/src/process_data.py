@@ -1,12 +1,43 @@
-from collections import defaultdict
-import xarray as xr
-import pandas as pd
+import sys
+from pathlib import Path
 import pydeck as pdk
-import h3
+
+# Share the binning engine with the app at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from hex_binning import bin_to_hex, display_frame, hex_frame
+from hex_lookup import grid_cells
+from streaming import stream_reduce
+from time_catalog import filter_period_files
+
+DAILY_DATA_DIR = "./GFED5/daily/"
+MONTHLY_DATA_DIR = "./GFED5/monthly/"
+
+
+def filter_files(start_date, end_date, data_type):
+    """
+    Select the `.nc` files of `data_type` ('Daily' or 'Monthly') covering a date range.
+
+    Daily files hold one month each and are matched on YYYYMM; monthly files
+    hold one year each and are matched on YYYY.
+
+    Returns:
+        tuple: (data directory, sorted list of file paths).
+    """
+    data_dir = DAILY_DATA_DIR if data_type == "Daily" else MONTHLY_DATA_DIR
+    all_files = sorted(Path(data_dir).glob("*.nc"))
+    filtered_files = filter_period_files(all_files, start_date, end_date)
+    return data_dir, filtered_files
+
+
+def bin_grid(grid, lat, lon, hex_res):
+    """Sum the positive cells of a time-reduced grid per hexagon; returns (uint64 hex ids, values)."""
+    cells = grid_cells(lat, lon, hex_res)
+    return bin_to_hex(grid, cells)
+
 
 def filter_files_return_layer(start_date, end_date, data_type, em_type, aggr_type, hex_res):
     """
-    Filters `.netcdf` files based on date range and data type, applies aggregation, 
+    Filters `.netcdf` files based on date range and data type, applies aggregation,
     bins the data into H3 hexagons, and returns a PyDeck layer.
 
     Parameters:
@@ -20,63 +51,16 @@ def filter_files_return_layer(start_date, end_date, data_type, em_type, aggr_typ
     Returns:
         pydeck.Layer: A PyDeck H3HexagonLayer for visualization.
     """
-    data_dir = DAILY_DATA_DIR if data_type == "Daily" else MONTHLY_DATA_DIR
-    
-    if data_dir == DAILY_DATA_DIR:
-        start_year_month = start_date.strftime("%Y%m")
-        end_year_month = end_date.strftime("%Y%m")
-
-        filtered_files = [
-            str(file) for file in all_files
-            if start_year_month <= file.stem[-6:] <= end_year_month
-        ]
-    else:
-        filtered_files = [
-            str(file) for file in all_files 
-            if start_date.year <= int(file.stem[-4:]) <= end_date.year
-        ]
-
-    ds = xr.open_mfdataset(filtered_files)[em_type]
-
-    if aggr_type == "mean":
-        ds = ds.mean(dim="time")
-    elif aggr_type == "sum":
-        ds = ds.sum(dim="time")
-    elif aggr_type == "max":
-        ds = ds.max(dim="time")
-    elif aggr_type == "min":
-        ds = ds.min(dim="time")
-    else:
-        raise ValueError(f"Unknown aggregation type: {aggr_type}")
-
-    lat = ds['lat'].values
-    lon = ds['lon'].values
-    data = ds.values
-
-    # Prepare lists to store results
-    hex_ids = []
-    values = []
-
-    # Iterate over the data array to aggregate into hexagons
-    for lat_idx, lat_val in enumerate(lat):
-        for lon_idx, lon_val in enumerate(lon):
-            value = data[lat_idx, lon_idx]
-            if value > 0:  # Only process positive values
-                hex_id = h3.latlng_to_cell(lat_val, lon_val, hex_res)
-                hex_ids.append(hex_id)
-                values.append(value)
-
-    # Create a dictionary for aggregation
-    hex_dict = defaultdict(float)
-    for hex_id, value in zip(hex_ids, values):
-        hex_dict[hex_id] += value
-
-    df = pd.DataFrame(hex_dict.items(), columns=["hex_id", "value"])
-    df['value'] = df['value'].astype(float).round(2)
+    _, filtered_files = filter_files(start_date, end_date, data_type)
+
+    grids, lat, lon = stream_reduce(filtered_files, [em_type], aggr_type)
+
+    # Map the whole grid to hex ids at once and sum positive cells per hexagon
+    df = hex_frame(*bin_grid(grids[em_type], lat, lon, hex_res))
 
     pdk_layer = pdk.Layer(
         "H3HexagonLayer",
-        data=df,
+        data=display_frame(df),
         pickable=True,
         stroked=False,
         filled=True,
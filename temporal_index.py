@@ -0,0 +1,202 @@
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from hex_binning import AGGREGATIONS
+
+INDEX_DIR = os.environ.get("TEMPORAL_INDEX_DIR", "./cache/temporal_index/")
+BLOCK_STEPS = int(os.environ.get("TEMPORAL_INDEX_BLOCK", "32"))
+
+
+def index_path(data_dir, variable, cache_dir=INDEX_DIR):
+    """Directory holding the index of `variable` for the files in `data_dir`."""
+    return Path(cache_dir) / Path(data_dir).name / variable
+
+
+class TemporalIndex:
+    """
+    Range-query index over the time axis of one variable.
+
+    Only cells that are positive at least once are indexed; all others can
+    never produce a positive aggregate and are dropped by the binning anyway.
+    For those cells the index keeps
+
+    - cumulative sums and non-NaN counts along time, so the sum or mean over
+      any window is two row lookups and a subtraction;
+    - the raw series plus the maxima/minima of blocks of `block` time steps,
+      with a sparse table over the blocks, so max and min over any window
+      read at most two partial blocks and two table rows.
+
+    Windows are half-open, [start, stop), on the time coordinate, and are
+    answered exactly: a window ending mid-month covers only its days. The
+    local path without an index aggregates whole files instead, so for the
+    same date range the two can differ at the edges.
+    """
+
+    def __init__(self, times, lat, lon, cells, csum, ccount, values, block, maxs, mins):
+        self.times = times
+        self.lat = lat
+        self.lon = lon
+        self.cells = cells
+        self.csum = csum
+        self.ccount = ccount
+        self.values = values
+        self.block = block
+        self.maxs = maxs
+        self.mins = mins
+
+    @classmethod
+    def build(cls, files, variable, path, block=BLOCK_STEPS):
+        """
+        Ingest `variable` from `files` (in time order) into an index at `path`.
+
+        Files are read one at a time and the arrays are written to disk as
+        they fill, so memory stays at one file plus the per-block tables.
+        The index replaces any previous one at `path` once it is complete.
+
+        Parameters:
+            files (list): NetCDF file paths.
+            variable (str): Emission type.
+            path (str or Path): Index directory.
+            block (int): Time steps per block of the max/min tables.
+
+        Returns:
+            TemporalIndex: The index, memory-mapped from `path`.
+        """
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        # First pass: find the cells that are ever positive and the length of the series
+        active, steps = None, 0
+        for file in files:
+            with xr.open_dataset(file) as ds:
+                positive = (ds[variable] > 0).any(dim="time").values
+                lat, lon, dtype = ds["lat"].values, ds["lon"].values, ds[variable].dtype
+                steps += ds.sizes["time"]
+            active = positive if active is None else active | positive
+        cells = np.flatnonzero(active)
+
+        # Second pass: append each file's series and extend the running sums and counts
+        times = np.empty(steps, dtype="datetime64[ns]")
+        values = np.lib.format.open_memmap(tmp / "values.npy", mode="w+", dtype=dtype, shape=(steps, len(cells)))
+        csum = np.lib.format.open_memmap(tmp / "csum.npy", mode="w+", dtype=np.float64, shape=(steps + 1, len(cells)))
+        ccount = np.lib.format.open_memmap(tmp / "ccount.npy", mode="w+", dtype=np.uint32, shape=(steps + 1, len(cells)))
+        csum[0], ccount[0] = 0, 0
+        row = 0
+        for file in files:
+            with xr.open_dataset(file) as ds:
+                da = ds[variable]
+                n = da.shape[0]
+                raw = da.values.reshape(n, -1)[:, cells]
+                times[row:row + n] = da["time"].values
+            values[row:row + n] = raw
+            csum[row + 1:row + n + 1] = csum[row] + np.cumsum(np.nan_to_num(raw), axis=0, dtype=np.float64)
+            ccount[row + 1:row + n + 1] = ccount[row] + np.cumsum(~np.isnan(raw), axis=0, dtype=np.uint32)
+            row += n
+
+        # Level 0 holds the max/min of each block; level k of the spans of 2**k blocks
+        blocks = steps // block
+        block_max = np.empty((blocks, len(cells)), dtype=dtype)
+        block_min = np.empty((blocks, len(cells)), dtype=dtype)
+        for b in range(blocks):
+            rows = values[b * block:(b + 1) * block]
+            block_max[b] = np.fmax.reduce(rows, axis=0)
+            block_min[b] = np.fmin.reduce(rows, axis=0)
+        maxs, mins = [block_max], [block_min]
+        span = 1
+        while 2 * span <= blocks:
+            maxs.append(np.fmax(maxs[-1][:-span], maxs[-1][span:]))
+            mins.append(np.fmin(mins[-1][:-span], mins[-1][span:]))
+            span *= 2
+
+        for array in (values, csum, ccount):
+            array.flush()
+        del values, csum, ccount
+        for name, array in (("times", times), ("lat", lat), ("lon", lon), ("cells", cells)):
+            np.save(tmp / f"{name}.npy", array)
+        for k, (level_max, level_min) in enumerate(zip(maxs, mins)):
+            np.save(tmp / f"max{k}.npy", level_max)
+            np.save(tmp / f"min{k}.npy", level_min)
+        with open(tmp / "meta.json", "w") as f:
+            json.dump({"levels": len(maxs), "steps": steps, "block": block}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map an index written by `build`."""
+        path = Path(path)
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in ("times", "lat", "lon", "cells", "csum", "ccount", "values")
+        }
+        maxs = [np.load(path / f"max{k}.npy", mmap_mode="r") for k in range(meta["levels"])]
+        mins = [np.load(path / f"min{k}.npy", mmap_mode="r") for k in range(meta["levels"])]
+        return cls(block=meta["block"], maxs=maxs, mins=mins, **arrays)
+
+    def bounds(self, start, stop):
+        """Return the row range [s, e) of the time steps in [start, stop)."""
+        s = int(np.searchsorted(self.times, np.datetime64(start, "ns"), side="left"))
+        e = int(np.searchsorted(self.times, np.datetime64(stop, "ns"), side="left"))
+        return s, max(s, e)
+
+    def window(self, start, stop, aggr):
+        """
+        Aggregate every indexed cell over the time window [start, stop).
+
+        Parameters:
+            start (datetime-like): First time included.
+            stop (datetime-like): First time excluded.
+            aggr (str): Aggregation type ('sum', 'mean', 'max', 'min').
+
+        Returns:
+            numpy.ndarray: float64 value per cell in `self.cells`; NaN where
+            the window holds no data.
+        """
+        if aggr not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation type: {aggr}")
+        s, e = self.bounds(start, stop)
+        if s == e:
+            return np.full(len(self.cells), np.nan)
+
+        if aggr in ("sum", "mean"):
+            total = self.csum[e] - self.csum[s]
+            if aggr == "sum":
+                return total
+            count = self.ccount[e].astype(np.int64) - self.ccount[s]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(count > 0, total / count, np.nan)
+
+        table, combine = (self.maxs, np.fmax) if aggr == "max" else (self.mins, np.fmin)
+        # Whole blocks from the table, the partial blocks at either end from the series
+        first, last = -(-s // self.block), e // self.block
+        if first >= last:
+            return combine.reduce(self.values[s:e], axis=0).astype(np.float64)
+        k = (last - first).bit_length() - 1
+        result = combine(table[k][first], table[k][last - (1 << k)])
+        if s < first * self.block:
+            result = combine(result, combine.reduce(self.values[s:first * self.block], axis=0))
+        if last * self.block < e:
+            result = combine(result, combine.reduce(self.values[last * self.block:e], axis=0))
+        return result.astype(np.float64)
+
+
+if __name__ == "__main__":
+    # Ingest step, run once per data directory and variable:
+    #   python temporal_index.py ./GFED5/daily C CO2 CH4
+    data_dir, variables = sys.argv[1], sys.argv[2:]
+    files = [str(file) for file in sorted(Path(data_dir).glob("*.nc"))]
+    for variable in variables:
+        TemporalIndex.build(files, variable, index_path(data_dir, variable))
+        print(index_path(data_dir, variable))
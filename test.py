@@ -1,15 +1,14 @@
 import numpy as np
-import xarray as xr
 import pandas as pd
 import pydeck as pdk
 import streamlit as st
 from pathlib import Path
 from streamlit_js_eval import streamlit_js_eval
-from datetime import datetime
-from dask.dataframe import from_pandas
 
 import streamlit.components.v1 as components
 
+from streaming import stream_reduce
+
 st.set_page_config(layout="wide")
 
 # JavaScript to capture viewport changes
@@ -47,23 +46,22 @@ screen_height = streamlit_js_eval(js_expressions='screen.height', key='SCR') or
 
 @st.cache_data
 def get_filtered_data_in_viewport(filtered_files, emission_type, viewport_bounds):
-    min_lat, min_lon, max_lat, max_lon = viewport_bounds
-
     st.write(f"Filtering data within viewport bounds: {viewport_bounds}")
 
-    ds = xr.open_mfdataset(filtered_files)[emission_type]
-    st.write(f"Dataset loaded with shape: {ds.shape}")
+    # Stream the viewport window through a running mean instead of copying the grid into pandas twice
+    grids, lat, lon = stream_reduce(filtered_files, [emission_type], "mean", bbox=viewport_bounds)
+    st.write(f"Filtered dataset shape: {grids[emission_type].shape}")
 
-    filtered_ds = ds.sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
-    st.write(f"Filtered dataset shape: {filtered_ds.shape}")
-
-    if filtered_ds.size == 0:
+    if grids[emission_type].size == 0:
         st.warning("No data points found within the selected viewport bounds.")
         return pd.DataFrame()
 
-    mean_emission = filtered_ds.mean(dim="time")
-
-    mean_emission_df = from_pandas(mean_emission.to_dataframe().reset_index(), npartitions=100, sort=False).compute(schedule="threads")
+    lat2d, lon2d = np.meshgrid(lat, lon, indexing="ij")
+    mean_emission_df = pd.DataFrame({
+        "lat": lat2d.ravel(),
+        "lon": lon2d.ravel(),
+        emission_type: grids[emission_type].ravel(),
+    })
 
     return mean_emission_df
 
@@ -1,14 +1,16 @@
 import streamlit as st
-import xarray as xr
 import pandas as pd
 from pathlib import Path
-from datetime import datetime
-from dask.dataframe import from_pandas
-import numpy as np
 
 # Import your custom component function
 # (Adjust this import path to match where you keep your component's Python wrapper)
 from map_component import map_component  # <-- hypothetical name, update to your real file/function
+from streaming import stream_reduce
+from dataset_pool import get_pool
+from hex_binning import bin_to_hex, hex_frame
+from hex_lookup import grid_cells
+from spatial_index import grid_window, lod_resolution, pad_bounds, viewport_bounds
+from aggregation_service import SERVICE_URL, AggregationClient
 
 # Set up Streamlit layout
 st.set_page_config(layout="wide")
@@ -33,26 +35,19 @@ def get_filtered_files(data_dir, start_date, end_date):
         ]
 
 # Function to filter data based on the viewport bounds
-def get_filtered_data_in_viewport(filtered_files, emission_type, viewport_bounds):
+def get_filtered_data_in_viewport(filtered_files, emission_type, viewport_bounds, resolution=4):
     # viewport_bounds: (min_lat, min_lon, max_lat, max_lon)
-    min_lat, min_lon, max_lat, max_lon = viewport_bounds
+    # Read and bin only the grid rows/columns inside the viewport
+    grids, lat, lon = stream_reduce(filtered_files, [emission_type], "mean", bbox=viewport_bounds)
+    if grids[emission_type].size == 0:
+        return pd.DataFrame(columns=["hex_id", "value"])
 
-    ds = xr.open_mfdataset(filtered_files)[emission_type]
-    filtered_ds = ds.sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
-    if filtered_ds.size == 0:
-        ds.close()
-        return pd.DataFrame()
+    coords = get_pool().coords(filtered_files[0])
+    rows, cols = grid_window(coords["lat"], coords["lon"], viewport_bounds)
+    cells = grid_cells(coords["lat"], coords["lon"], resolution)[rows, cols]
+    hex_ids, values = bin_to_hex(grids[emission_type], cells)
 
-    mean_emission = filtered_ds.mean(dim="time")
-    ds.close()
-    mean_emission_df = from_pandas(
-        mean_emission.to_dataframe().reset_index(),
-        npartitions=100,
-        sort=False
-    ).compute(schedule="threads")
-    mean_emission.close()
-
-    return mean_emission_df
+    return hex_frame(hex_ids, values)
 
 def main():
     st.title("Custom Deck.GL Map Component with Viewport-Based Filtering")
@@ -93,26 +88,37 @@ def main():
             "pitch": 0
         }
 
-    # Calculate the bounding box
-    # For a more precise bounding box, you'd read from the actual viewport
-    # in the custom component. This is just a placeholder.
-    buffer = 0.5
-    lat, lon = st.session_state["viewState"]["latitude"], st.session_state["viewState"]["longitude"]
-    viewport_bounds = (lat - buffer, lon - buffer, lat + buffer, lon + buffer)
+    # The component reports the view it shows; its latest value is read before
+    # rendering so the bounding box matches what the user is looking at
+    view = st.session_state.get("my_map") or {}
+    if view.get("viewState"):
+        st.session_state["viewState"] = view["viewState"]
+
+    # Calculate the bounding box, with a margin so small pans stay covered
+    if view.get("bounds"):
+        viewport = pad_bounds(view["bounds"], 0.25)
+    else:
+        viewport = viewport_bounds(st.session_state["viewState"], margin=0.25)
 
-    # Filter data for the current bounding box
-    mean_emission_df = get_filtered_data_in_viewport(filtered_files, emission_type, viewport_bounds)
+    # Resolution from the zoom level: as fine as the hexagon budget allows
+    resolution = lod_resolution(viewport, max_hexes=50000)
 
-    # Convert to a dictionary or list-of-dicts for sending to the JS component
-    map_data = mean_emission_df.to_dict(orient="records")
+    # Filter data for the current bounding box, on the aggregation service if one is running
+    if SERVICE_URL:
+        mean_emission_df = AggregationClient().aggregate(
+            data_type, emission_type, pick_start_date, pick_end_date + pd.Timedelta(days=1), resolution, "mean",
+            bbox=viewport,
+        )
+    else:
+        mean_emission_df = get_filtered_data_in_viewport(filtered_files, emission_type, viewport, resolution)
 
     # Call the custom component, passing:
-    # 1) the data we want to render (map_data)
-    # 2) the emission_type (so the JS side can know which property to use as weight)
+    # 1) the data we want to render, sent as packed binary columns
+    # 2) the emission_type (named in the tooltip)
     # 3) the current view state (so the map starts at the right zoom/center)
     # The component should return an updated viewState when user pans/zooms.
     component_return = map_component(
-        data=map_data,
+        data=mean_emission_df,
         emission_type=emission_type,
         initial_view_state=st.session_state["viewState"],
         key="my_map"
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from map_component import HISTORY_FRAMES, frame_delta, frame_update
+
+
+def random_frame(rng, pool, n):
+    hex_ids = rng.choice(pool, size=n, replace=False).astype(np.uint64)
+    values = rng.gamma(1.0, 50.0, size=n).astype(np.float32)
+    values[rng.random(n) < 0.1] = np.nan
+    return hex_ids, values
+
+
+def apply_delta(ids, values, removed, changed, changed_values, added_ids, added_values):
+    # What the browser does with a delta: overwrite, then drop, then append
+    values = values.copy()
+    values[changed] = changed_values
+    keep = np.ones(len(ids), dtype=bool)
+    keep[removed] = False
+    return np.concatenate([ids[keep], added_ids]), np.concatenate([values[keep], added_values])
+
+
+def as_dict(ids, values):
+    return dict(zip(ids.tolist(), values.tolist()))
+
+
+def assert_same_frame(ids, values, hex_ids, new_values):
+    assert len(ids) == len(set(ids.tolist()))
+    got, want = as_dict(ids, values), as_dict(hex_ids, new_values)
+    assert got.keys() == want.keys()
+    for key, value in want.items():
+        assert got[key] == value or (np.isnan(got[key]) and np.isnan(value))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_delta_applied_to_the_old_frame_gives_the_new_frame(seed):
+    rng = np.random.default_rng(seed)
+    pool = np.arange(1, 500, dtype=np.uint64) * 7919
+    old_ids, old_values = random_frame(rng, pool, 200)
+    hex_ids, values = random_frame(rng, pool, 220)
+    # Some shared hexagons keep their value, NaN included
+    shared = np.isin(hex_ids, old_ids)
+    old_lookup = as_dict(old_ids, old_values)
+    for i in np.flatnonzero(shared)[::3]:
+        values[i] = old_lookup[int(hex_ids[i])]
+
+    removed, changed, changed_values, added, mirror_ids, mirror_values = frame_delta(
+        old_ids, old_values, hex_ids, values
+    )
+    ids, applied = apply_delta(old_ids, old_values, removed, changed, changed_values, hex_ids[added], values[added])
+
+    assert_same_frame(ids, applied, hex_ids, values)
+    np.testing.assert_array_equal(ids, mirror_ids)
+    np.testing.assert_array_equal(applied, mirror_values)
+    assert len(changed) < int(shared.sum())
+
+
+def test_delta_against_an_empty_frame_adds_everything():
+    hex_ids = np.array([5, 3, 9], dtype=np.uint64)
+    values = np.array([1, 2, 3], dtype=np.float32)
+    empty = np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.float32)
+    removed, changed, _, added, mirror_ids, _ = frame_delta(*empty, hex_ids, values)
+    assert not len(removed) and not len(changed)
+    assert added.all()
+    np.testing.assert_array_equal(mirror_ids, hex_ids)
+
+
+def test_first_frame_is_sent_whole():
+    args, state = frame_update(None, np.array([1, 2], dtype=np.uint64), np.array([1, 2], dtype=np.float32))
+    assert args["frame"] == 0 and args["baseFrame"] is None
+    assert np.frombuffer(args["hexIds"], dtype="<u8").tolist() == [1, 2]
+
+
+def test_small_change_is_sent_as_a_delta():
+    hex_ids = np.arange(1, 101, dtype=np.uint64)
+    values = np.ones(100, dtype=np.float32)
+    _, state = frame_update(None, hex_ids, values)
+
+    new_values = values.copy()
+    new_values[:5] = 2
+    args, state = frame_update(state, hex_ids, new_values, base=0)
+    assert args["frame"] == 1 and args["baseFrame"] == 0
+    assert np.frombuffer(args["changed"], dtype="<u4").tolist() == [0, 1, 2, 3, 4]
+    assert not args["hexIds"] and not args["removed"]
+
+
+def test_unchanged_frame_keeps_its_number():
+    hex_ids = np.arange(1, 11, dtype=np.uint64)
+    values = np.ones(10, dtype=np.float32)
+    _, state = frame_update(None, hex_ids, values)
+    args, state = frame_update(state, hex_ids, values, base=0)
+    assert args["frame"] == 0 and state["frame"] == 0
+
+
+def test_large_change_resyncs_the_whole_frame():
+    hex_ids = np.arange(1, 101, dtype=np.uint64)
+    _, state = frame_update(None, hex_ids, np.ones(100, dtype=np.float32))
+    args, state = frame_update(state, hex_ids + 1000, np.ones(100, dtype=np.float32), base=0)
+    assert args["frame"] == 1 and args["baseFrame"] is None
+    assert len(np.frombuffer(args["hexIds"], dtype="<u8")) == 100
+
+
+def test_base_outside_the_history_resyncs():
+    hex_ids = np.arange(1, 101, dtype=np.uint64)
+    state = None
+    for i in range(HISTORY_FRAMES + 1):
+        _, state = frame_update(state, hex_ids, np.full(100, i, dtype=np.float32))
+    assert 0 not in state["frames"] and len(state["frames"]) == HISTORY_FRAMES
+
+    args, _ = frame_update(state, hex_ids, np.zeros(100, dtype=np.float32), base=0)
+    assert args["baseFrame"] is None
+
+    # Frame 1 is still held, so a browser showing it gets a delta
+    values = np.ones(100, dtype=np.float32)
+    values[10] = 0
+    args, _ = frame_update(state, hex_ids, values, base=1)
+    assert args["baseFrame"] == 1 and not args["hexIds"]
+    assert np.frombuffer(args["changed"], dtype="<u4").tolist() == [10]
@@ -0,0 +1,36 @@
+import numpy as np
+
+from precomputed import Manifest, output_key, output_path, period_label, read_output, write_output
+
+
+def test_period_label():
+    assert period_label(["GFED5_Beta_daily_202201.nc"]) == "202201"
+    assert period_label(["GFED5_Beta_daily_202201.nc", "GFED5_Beta_daily_202212.nc"]) == "202201-202212"
+
+
+def test_output_round_trip(tmp_path):
+    path = output_path("./GFED5/daily", "C", "202201", 4, "sum", out_dir=tmp_path)
+    write_output(path, np.array([2**60, 3], dtype=np.uint64), np.array([1.5, np.nan], dtype=np.float32))
+    hex_ids, values = read_output(path)
+    assert hex_ids.dtype == np.uint64 and hex_ids.tolist() == [2**60, 3]
+    assert values[0] == 1.5 and np.isnan(values[1])
+
+
+def test_manifest_lookup_and_reload(tmp_path):
+    manifest = Manifest(tmp_path)
+    args = ("./GFED5/daily", "C", "202201", 4, "sum")
+    key = output_key(*args)
+    assert key == "daily/C/sum/res4/202201"
+    assert manifest.lookup(*args) is None
+
+    path = output_path(*args, out_dir=tmp_path)
+    manifest.add(key, {"path": str(path.relative_to(tmp_path)), "rows": 0})
+    # Recorded but not written yet: not done
+    assert manifest.lookup(*args) is None
+
+    write_output(path, np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.float32))
+    manifest.save()
+    reloaded = Manifest(tmp_path)
+    assert reloaded.done(key)
+    assert reloaded.lookup(*args) == path
+    assert reloaded.lookup("./GFED5/monthly", "C", "2022", 4, "sum") is None
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from result_cache import ResultCache
+
+
+class Rerun(BaseException):
+    """Stands in for Streamlit's script-control exceptions."""
+
+
+def frame(value):
+    return pd.DataFrame({"hex_id": [1, 2], "value": [value, value]})
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def start_waiters(cache, key, compute, n):
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(cache.get_or_compute(key, compute))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: cache.stats()["coalesced"] == n)
+    return threads, results, errors
+
+
+def run_owner(cache, key, compute):
+    # Runs the first caller in a thread and returns once its computation has started
+    started, outcome = threading.Event(), {}
+
+    def owner_compute():
+        started.set()
+        return compute()
+
+    def run():
+        try:
+            outcome["df"] = cache.get_or_compute(key, owner_compute)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(5)
+    return thread, outcome
+
+
+def test_hit_after_compute():
+    cache = ResultCache(spill_dir=None)
+    df = cache.get_or_compute("k", lambda: frame(1.0))
+    assert cache.get_or_compute("k", lambda: pytest.fail("recomputed")) is df
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_concurrent_requests_share_one_computation():
+    cache = ResultCache(spill_dir=None)
+    release, calls = threading.Event(), []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return frame(1.0)
+
+    owner, outcome = run_owner(cache, "k", compute)
+    threads, results, errors = start_waiters(cache, "k", compute, 4)
+    release.set()
+    for thread in [owner, *threads]:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert not errors
+    assert all(df is outcome["df"] for df in results)
+    assert cache.stats()["inflight"] == 0
+
+
+def test_waiters_get_the_error_and_later_calls_retry():
+    cache = ResultCache(spill_dir=None)
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("bad input")
+
+    owner, outcome = run_owner(cache, "k", fail)
+    threads, results, errors = start_waiters(cache, "k", fail, 3)
+    release.set()
+    for thread in [owner, *threads]:
+        thread.join(5)
+
+    assert isinstance(outcome["error"], ValueError)
+    assert not results
+    assert len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+    assert cache.stats()["inflight"] == 0
+    assert cache.get_or_compute("k", lambda: frame(2.0))["value"].iloc[0] == 2.0
+
+
+def test_abandoned_computation_is_taken_over_by_a_waiter():
+    cache = ResultCache(spill_dir=None)
+    release, calls = threading.Event(), []
+
+    def interrupted():
+        release.wait(5)
+        raise Rerun()
+
+    def compute():
+        calls.append(1)
+        return frame(3.0)
+
+    owner, outcome = run_owner(cache, "k", interrupted)
+    threads, results, errors = start_waiters(cache, "k", compute, 3)
+    release.set()
+    for thread in [owner, *threads]:
+        thread.join(5)
+
+    # The interruption stays with the owner; one waiter computes for the rest
+    assert isinstance(outcome["error"], Rerun)
+    assert not errors
+    assert len(calls) == 1
+    assert len(results) == 3 and all(df["value"].iloc[0] == 3.0 for df in results)
+    assert cache.stats()["inflight"] == 0
+
+
+def test_evicted_entries_spill_and_reload(tmp_path):
+    first = frame(1.0)
+    cache = ResultCache(max_bytes=1, spill_dir=tmp_path)
+    cache.put("a", first)
+    cache.put("b", frame(2.0))
+    assert cache.stats()["spilled_entries"] == 1
+
+    reloaded = cache.get("a")
+    pd.testing.assert_frame_equal(reloaded, first)
+    assert cache.stats()["spill_hits"] == 1
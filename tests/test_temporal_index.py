@@ -0,0 +1,80 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from temporal_index import TemporalIndex
+
+BLOCK = 4
+
+
+@pytest.fixture(scope="module")
+def series(tmp_path_factory):
+    """Two monthly files of a small grid with NaNs and never-positive cells, and their full series."""
+    rng = np.random.default_rng(0)
+    root = tmp_path_factory.mktemp("data")
+    lat, lon = np.array([10.25, 9.75, 9.25]), np.array([-0.25, 0.25, 0.75, 1.25])
+    files, parts = [], []
+    for month, days in (("2022-01", 31), ("2022-02", 28)):
+        times = pd.date_range(f"{month}-01", periods=days, freq="D")
+        values = rng.gamma(1.0, 2.0, size=(days, len(lat), len(lon))).astype(np.float32)
+        values[rng.random(values.shape) < 0.2] = np.nan
+        values[:, 0, 0] = 0
+        values[:, 2, 3] = np.nan
+        values[:, 1, 2] = -1.0
+        path = root / f"GFED5_Beta_daily_{month.replace('-', '')}.nc"
+        xr.Dataset({"C": (("time", "lat", "lon"), values)}, coords={"time": times, "lat": lat, "lon": lon}).to_netcdf(path)
+        files.append(str(path))
+        parts.append(values)
+    times = np.concatenate([xr.open_dataset(file)["time"].values for file in files])
+    return files, times, np.concatenate(parts).reshape(len(times), -1)
+
+
+@pytest.fixture(scope="module")
+def index(series, tmp_path_factory):
+    files, _, _ = series
+    return TemporalIndex.build(files, "C", tmp_path_factory.mktemp("index") / "C", block=BLOCK)
+
+
+def brute_force(raw, s, e, aggr):
+    window = raw[s:e].astype(np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return {"sum": np.nansum, "mean": np.nanmean, "max": np.nanmax, "min": np.nanmin}[aggr](window, axis=0)
+
+
+def test_indexes_only_cells_that_are_ever_positive(series, index):
+    _, _, raw = series
+    expected = np.flatnonzero((raw > 0).any(axis=0))
+    np.testing.assert_array_equal(index.cells, expected)
+
+
+@pytest.mark.parametrize("aggr", ["sum", "mean", "max", "min"])
+@pytest.mark.parametrize("s, e", [(0, 59), (0, 1), (3, 4), (5, 7), (1, 9), (4, 12), (3, 45), (30, 32), (13, 58)])
+def test_window_matches_brute_force(series, index, aggr, s, e):
+    _, times, raw = series
+    stop = times[e] if e < len(times) else times[-1] + np.timedelta64(1, "D")
+    expected = brute_force(raw[:, index.cells], s, e, aggr)
+    np.testing.assert_allclose(index.window(times[s], stop, aggr), expected, rtol=1e-6, equal_nan=True)
+
+
+def test_rebuild_replaces_the_index(series, tmp_path):
+    files, times, _ = series
+    path = tmp_path / "C"
+    TemporalIndex.build(files, "C", path, block=BLOCK)
+    rebuilt = TemporalIndex.build(files[:1], "C", path, block=BLOCK)
+    assert len(TemporalIndex.load(path).times) == len(rebuilt.times) == 31
+    assert not path.with_name("C.tmp").exists()
+
+
+def test_empty_window_is_nan(series, index):
+    _, times, _ = series
+    assert np.isnan(index.window(times[5], times[5], "sum")).all()
+
+
+def test_unknown_aggregation(series, index):
+    _, times, _ = series
+    with pytest.raises(ValueError):
+        index.window(times[0], times[10], "median")
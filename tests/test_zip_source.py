@@ -0,0 +1,83 @@
+import threading
+import zipfile
+
+import pytest
+
+from zip_source import ZipSource
+
+SIZE = 1000
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "gfed_data.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        for month in ("202201", "202202", "202203", "202204"):
+            zf.writestr(f"GFED5/daily/GFED5_Beta_daily_{month}.nc", bytes([int(month[-1])]) * SIZE)
+        zf.writestr("GFED5/monthly/GFED5_Beta_monthly_2022.nc", b"m" * SIZE)
+        zf.writestr("GFED5/readme.txt", b"not data")
+    return path
+
+
+def test_lists_members_by_kind(archive, tmp_path):
+    source = ZipSource(archive, cache_dir=tmp_path / "cache")
+    assert len(source.list("daily")) == 4
+    assert source.periods("daily") == ["202201", "202202", "202203", "202204"]
+    assert source.periods("monthly") == ["2022"]
+
+
+def test_extracts_once_and_keeps_the_content(archive, tmp_path):
+    source = ZipSource(archive, cache_dir=tmp_path / "cache")
+    name = source.list("daily")[1]
+    path = source.extract(name)
+    assert open(path, "rb").read() == bytes([2]) * SIZE
+    assert source.extract(name) == path
+    assert not list((tmp_path / "cache").glob("*/*.tmp"))
+
+
+def test_evicts_least_recently_used_but_not_pinned(archive, tmp_path):
+    source = ZipSource(archive, cache_dir=tmp_path / "cache", max_bytes=2 * SIZE)
+    jan, feb, mar, apr = source.list("daily")
+
+    with source.pinned([jan, feb, mar]) as paths:
+        # Over budget, but every file is pinned by the running query
+        assert all(tmp_path.joinpath(p).exists() for p in paths)
+        assert source._bytes == 3 * SIZE
+
+    source.extract(feb)
+    source.extract(apr)
+    # January was the least recently used, then March
+    assert not source.local_path(jan).exists()
+    assert not source.local_path(mar).exists()
+    assert source.local_path(feb).exists() and source.local_path(apr).exists()
+
+
+def test_files_in_use_are_not_evicted(archive, tmp_path):
+    source = ZipSource(archive, cache_dir=tmp_path / "cache", max_bytes=SIZE)
+    jan, feb = source.list("daily")[:2]
+    jan_path = source.extract(jan)
+    source.in_use = lambda path: path == jan_path
+    source.extract(feb)
+    assert source.local_path(jan).exists()
+
+
+def test_adopts_files_extracted_by_earlier_runs(archive, tmp_path):
+    first = ZipSource(archive, cache_dir=tmp_path / "cache")
+    path = first.extract(first.list("monthly")[0])
+    second = ZipSource(archive, cache_dir=tmp_path / "cache")
+    assert second._bytes == SIZE
+    assert second.extract(second.list("monthly")[0]) == path
+
+
+def test_concurrent_extracts_of_one_member_share_the_file(archive, tmp_path):
+    source = ZipSource(archive, cache_dir=tmp_path / "cache")
+    name = source.list("daily")[0]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(source.extract(name))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(set(results)) == 1 and len(results) == 8
+    assert source._bytes == SIZE
+    assert not source._inflight
@@ -0,0 +1,120 @@
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dataset_pool import get_pool
+
+
+def file_period(file):
+    """Period of a GFED5 file from the digits ending its name: YYYYMM (daily) or YYYY (monthly)."""
+    return re.search(r"(\d+)$", Path(file).stem).group(1)
+
+
+def filter_period_files(files, start_date, end_date):
+    """
+    Select the GFED5 files whose period overlaps [start_date, end_date].
+
+    Daily files hold one month each and are matched on YYYYMM; monthly files
+    hold one year each and are matched on YYYY.
+
+    Returns:
+        list: Matching file paths as strings, in the order given.
+    """
+    start_year_month = start_date.strftime("%Y%m")
+    end_year_month = end_date.strftime("%Y%m")
+    selected = []
+    for file in files:
+        period = file_period(file)
+        if len(period) == 6:
+            keep = start_year_month <= period <= end_year_month
+        else:
+            keep = start_date.year <= int(period) <= end_date.year
+        if keep:
+            selected.append(str(file))
+    return selected
+
+
+class TimeCatalog:
+    """
+    Index of every time step in a set of NetCDF directories.
+
+    Each row maps a timestamp to the file that holds it and its offset along
+    the file's time dimension, so a query can read exactly the requested
+    steps instead of whole monthly or yearly files.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    @classmethod
+    def build(cls, data_dirs):
+        """
+        Scan the time coordinate of every `.nc` file in `data_dirs`.
+
+        Parameters:
+            data_dirs (list): Directories such as DAILY_DATA_DIR and MONTHLY_DATA_DIR.
+
+        Returns:
+            TimeCatalog: The catalog.
+        """
+        return cls.from_files({data_dir: sorted(Path(data_dir).glob("*.nc")) for data_dir in data_dirs})
+
+    @classmethod
+    def from_files(cls, files_by_dir):
+        """
+        Scan the time coordinate of the given files only.
+
+        Parameters:
+            files_by_dir (dict): Maps a data directory to its NetCDF file paths.
+
+        Returns:
+            TimeCatalog: The catalog.
+        """
+        frames = []
+        for data_dir, files in files_by_dir.items():
+            for file in files:
+                times = get_pool().coords(file)["time"]
+                frames.append(pd.DataFrame({
+                    "data_dir": str(data_dir),
+                    "time": times,
+                    "file": str(file),
+                    "offset": np.arange(len(times)),
+                }))
+        columns = ["data_dir", "time", "file", "offset"]
+        entries = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+        return cls(entries.sort_values(["data_dir", "time"], ignore_index=True))
+
+    def times(self, data_dir):
+        """Return all timestamps available in `data_dir`."""
+        return self.entries.loc[self.entries["data_dir"] == str(data_dir), "time"].to_numpy()
+
+    def select(self, data_dir, start, stop):
+        """
+        Locate the time steps of `data_dir` in the window [start, stop).
+
+        Parameters:
+            data_dir (str): One of the catalogued directories.
+            start (datetime-like): First time included.
+            stop (datetime-like): First time excluded.
+
+        Returns:
+            list: `(file, start_offset, stop_offset)` slices, one per run of
+            consecutive steps, in time order.
+        """
+        entries = self.entries
+        rows = entries[
+            (entries["data_dir"] == str(data_dir))
+            & (entries["time"] >= pd.Timestamp(start))
+            & (entries["time"] < pd.Timestamp(stop))
+        ]
+
+        slices = []
+        for file, offset in zip(rows["file"], rows["offset"]):
+            if slices and slices[-1][0] == file and slices[-1][2] == offset:
+                slices[-1] = (file, slices[-1][1], int(offset) + 1)
+            else:
+                slices.append((file, int(offset), int(offset) + 1))
+        return slices
+
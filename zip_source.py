@@ -0,0 +1,186 @@
+import contextlib
+import os
+import shutil
+import threading
+import zipfile
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+from dataset_pool import get_pool
+
+EXTRACT_DIR = os.environ.get("ZIP_EXTRACT_DIR", "./cache/gfed_zip/")
+EXTRACT_BYTES = int(os.environ.get("ZIP_EXTRACT_BYTES", str(20 * 2**30)))
+
+# Archive served when the extracted data directories are missing
+DATA_ZIP = "./gfed_data.zip"
+
+
+class ZipSource:
+    """
+    NetCDF members of the GFED5 zip archive, extracted only when a query needs them.
+
+    Opening the source reads just the zip central directory. Members are
+    grouped by the name of their parent directory ('daily' or 'monthly').
+    Extracted files are kept in `cache_dir` under the same grouping, and the
+    least recently used ones are deleted once they exceed `max_bytes`.
+
+    Files pinned by a running query and files `in_use` reports as open are
+    never deleted; a query larger than `max_bytes` overshoots the budget until
+    it releases its pins. Members are decompressed outside the lock, so a long
+    extraction holds up only the threads waiting for that same member.
+    """
+
+    def __init__(self, zip_path, cache_dir=EXTRACT_DIR, max_bytes=EXTRACT_BYTES, in_use=None):
+        self.zip_path = str(zip_path)
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.in_use = in_use or (lambda path: False)
+        self._pins = Counter()
+        self._zip = zipfile.ZipFile(self.zip_path)
+        self.members = {
+            info.filename: info for info in self._zip.infolist()
+            if info.filename.endswith(".nc") and not info.is_dir()
+        }
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+        # Adopt files extracted by earlier runs, oldest first
+        self._extracted = OrderedDict()
+        if self.cache_dir.exists():
+            for path in sorted(self.cache_dir.glob("*/*.nc"), key=lambda p: p.stat().st_mtime):
+                self._extracted[path] = path.stat().st_size
+        self._bytes = sum(self._extracted.values())
+
+    def list(self, kind):
+        """Return the member names of `kind` ('daily' or 'monthly'), sorted by file name."""
+        names = [name for name in self.members if Path(name).parent.name == kind]
+        return sorted(names, key=lambda name: Path(name).name)
+
+    def periods(self, kind):
+        """Return the periods available for `kind`: YYYYMM for daily files, YYYY for monthly ones."""
+        digits = 6 if kind == "daily" else 4
+        return [Path(name).stem[-digits:] for name in self.list(kind)]
+
+    def local_path(self, name):
+        return self.cache_dir / Path(name).parent.name / Path(name).name
+
+    def extract(self, name, pin=False):
+        """
+        Return a local path for member `name`, extracting it if needed.
+
+        Parameters:
+            name (str): Member name as returned by `list`.
+            pin (bool): Keep the file until `unpin` releases it.
+
+        Returns:
+            str: Path of the extracted file.
+        """
+        path = self.local_path(name)
+        while True:
+            with self._lock:
+                if path in self._extracted and path.exists():
+                    self._extracted.move_to_end(path)
+                    self._pins[path] += pin
+                    return str(path)
+                # One thread extracts a member; others wait for it, not for the lock
+                future = self._inflight.get(path)
+                if future is None:
+                    future = self._inflight[path] = Future()
+                    break
+            # Raises what the extracting thread raised; retries if it was interrupted
+            future.result()
+
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with self._zip.open(self.members[name]) as src, open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 2**20)
+            os.replace(tmp_path, path)
+        except BaseException as e:
+            tmp_path.unlink(missing_ok=True)
+            with self._lock:
+                del self._inflight[path]
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+            raise
+
+        with self._lock:
+            self._extracted[path] = path.stat().st_size
+            self._bytes += self._extracted[path]
+            self._evict(keep=path)
+            self._pins[path] += pin
+            del self._inflight[path]
+        future.set_result(None)
+        return str(path)
+
+    def _evict(self, keep):
+        # Oldest first, skipping `keep`, pinned files and files still open
+        for old_path in list(self._extracted):
+            if self._bytes <= self.max_bytes:
+                break
+            if old_path == keep or self._pins.get(old_path) or self.in_use(str(old_path)):
+                continue
+            old_path.unlink(missing_ok=True)
+            self._bytes -= self._extracted.pop(old_path)
+
+    def unpin(self, paths):
+        """Release pins taken by `extract(..., pin=True)`."""
+        with self._lock:
+            for path in paths:
+                path = Path(path)
+                self._pins[path] -= 1
+                if self._pins[path] <= 0:
+                    del self._pins[path]
+
+    @contextlib.contextmanager
+    def pinned(self, names):
+        """Extract `names` and keep them on disk for the duration of the block; yields their paths."""
+        paths = []
+        try:
+            for name in names:
+                paths.append(self.extract(name, pin=True))
+            yield paths
+        finally:
+            self.unpin(paths)
+
+    def close(self):
+        self._zip.close()
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def get_zip_source(zip_path):
+    """Return the process-wide ZipSource for `zip_path`."""
+    with _sources_lock:
+        source = _sources.get(zip_path)
+        if source is None:
+            # Files the dataset pool holds open are read lazily and must stay on disk
+            source = _sources[zip_path] = ZipSource(zip_path, in_use=get_pool().is_open)
+        return source
+
+
+def list_data_files(data_dir, zip_path=DATA_ZIP):
+    """Return the NetCDF files of `data_dir`, or the zip members of its kind if the directory is missing."""
+    if os.path.isdir(data_dir):
+        return sorted(Path(data_dir).glob("*.nc"))
+    return [Path(name) for name in get_zip_source(zip_path).list(Path(data_dir).name)]
+
+
+@contextlib.contextmanager
+def open_data_files(data_dir, files, zip_path=DATA_ZIP):
+    """
+    Make `files` from `list_data_files` readable for the duration of the block.
+
+    Files of an extracted directory are yielded as they are; zip members are
+    extracted and pinned until the block exits, and their paths yielded.
+    """
+    if os.path.isdir(data_dir):
+        yield files
+        return
+    with get_zip_source(zip_path).pinned(files) as paths:
+        yield paths